@@ -1,32 +1,69 @@
+from itertools import groupby, islice
+
 from memory import Memory
 from world_model import WorldModel
 from causal_library import CausalLibrary
 from planner import Planner
 from self_audit import SelfAudit
 from compute_controller import ComputeController
+from instrumentation import Instrumentation
+from learning_worker import LearningWorker
+from state import State
+
+def _mean(values):
+    return sum(values) / len(values) if len(values) else 0.0
+
 
 class Agent:
     # Main AGI-like agent
 
-    def __init__(self):
-        self.memory = Memory()
+    def __init__(self, memory=None, async_learning=False, max_pending=64, verbose=True,
+                 instrumentation=None, latency_budget=None):
+        # Pass a Memory (e.g. Memory.load(path)) to start from a warm snapshot.
+        # async_learning moves hypothesis testing and self-audit onto a
+        # background thread; call flush_learning() to wait for it.
+        # Pass Instrumentation(enabled=True) to collect phase timings.
+        # latency_budget (seconds) bounds planning per act() by a deadline
+        # instead of a fixed depth.
+        self.verbose = verbose
+        self.instrumentation = Instrumentation() if instrumentation is None else instrumentation
+        self.memory = Memory() if memory is None else memory
         self.world_model = WorldModel(self.memory)
         self.causal_library = CausalLibrary(self.memory)
         self.planner = Planner(self.world_model, self.memory)
         self.self_audit = SelfAudit(self.causal_library)
-        self.compute_controller = ComputeController()
+        self.compute_controller = ComputeController(latency_budget)
 
         self.episode_count = 0
         self.learned_rules = 0
+        self.hypothesis_window = 32  # recent transitions each hypothesis is scored on
+        self.max_hypotheses = 15     # candidates tried per surprise event
+        self.hypotheses_tested = 0
+        self.audit_activations = 0
+
+        # Receding-horizon plan reuse: the unexecuted tail of the last plan, the
+        # goal it was made for and the state it expects to see next
+        self.replan_threshold = 0.5  # prediction error that forces a replan
+        self._plan_tail = None
+        self._plan_goal = None
+        self._plan_expected = None
+        self.plans_reused = 0
+
+        self.learning_worker = LearningWorker(self._learn, max_pending) if async_learning else None
 
     def act(self, state, goal, world):
+        with self.instrumentation.phase('act'):
+            return self._act(State.coerce(state), goal)
+
+    def _act(self, state, goal):
         # Adjust thinking based on confidence
-        _, confidence = self.world_model.predict(state, 'wait')
-        thinking_level = self.compute_controller.adjust_thinking(confidence)
+        thinking_level = self.compute_controller.adjust_thinking(self.world_model.confidence)
 
-        # Plan
-        max_depth = self.compute_controller.get_planning_depth()
-        plan = self.planner.plan(state, goal, max_depth)
+        plan = self._reusable_plan(state, goal)
+        if plan is not None:
+            self.plans_reused += 1
+        else:
+            plan = self._plan(state, goal)
 
         if plan:
             action = plan[0]
@@ -36,64 +73,158 @@ class Agent:
             if pred_conf > 0.9 and thinking_level == 1:
                 pass
 
+            self._plan_tail = plan[1:]
+            self._plan_goal = goal
+            self._plan_expected = predicted_state
             return action, predicted_state
 
         # No plan found, use heuristic
+        self._plan_tail = None
         return self._heuristic_action(state, goal), None
 
+    def _plan(self, state, goal):
+        controller = self.compute_controller
+        max_depth = controller.get_planning_depth()
+        with self.instrumentation.phase('plan'):
+            if controller.latency_budget is None:
+                return self.planner.plan(state, goal, max_depth)
+            clock = self.planner.clock
+            start = clock()
+            budget = controller.plan_budget()
+            plan = self.planner.plan(state, goal, max_depth, deadline=start + budget)
+            controller.record_plan_time(clock() - start, budget)
+            return plan
+
+    def _reusable_plan(self, state, goal):
+        """
+        The last plan's tail, if it still applies: same goal, the last step
+        landed close to where the model said it would, and simulating the tail
+        from the observed state still reaches the goal. None means replan.
+        """
+        tail = self._plan_tail
+        if not tail or goal != self._plan_goal:
+            return None
+        if self.world_model._calculate_error(self._plan_expected, state) > self.replan_threshold:
+            return None
+        final_state, _ = self.planner.simulate(state, tail)
+        if not self.planner._goal_achieved(final_state, goal):
+            return None
+        return tail
+
     def learn_from_experience(self, state, action, next_state, world):
+        with self.instrumentation.phase('learn'):
+            self._learn_from_experience(State.coerce(state), action, State.coerce(next_state))
+
+    def _learn_from_experience(self, state, action, next_state):
         # Update world model
-        surprise = self.world_model.update_from_experience(state, action, next_state)
+        with self.instrumentation.phase('model_update'):
+            surprise = self.world_model.update_from_experience(state, action, next_state)
 
         # Store episode
         self.memory.store_episode(state, action, next_state, surprise < 0.5)
 
+        generate = self.compute_controller.should_generate_hypotheses(surprise)
+        audit = self.self_audit.should_activate(surprise)
+        if not (generate or audit):
+            return
+
+        predicted, _ = self.world_model.predict(state, action)
+        worker = self.learning_worker
+        if worker is None:
+            self._learn(self.memory.episodes, state, action, next_state, surprise, predicted, generate, audit)
+        else:
+            # The worker gets its own copy of the recent episodes, so later
+            # stores can't shift the window under it
+            n = max(self.hypothesis_window, self.causal_library.fit_window)
+            episodes = self.memory.episode_snapshot(n)
+            worker.submit(episodes, state, action, next_state, surprise, predicted, generate, audit)
+
+    def _learn(self, episodes, state, action, next_state, surprise, predicted, generate, audit):
+        """Hypothesis search and self-audit for one surprising transition"""
         # Learn new rules if surprised
-        if self.compute_controller.should_generate_hypotheses(surprise):
-            hypotheses = self.causal_library.generate_hypotheses(state, action, surprise)
+        if generate:
+            with self.instrumentation.phase('hypotheses'):
+                self._search_hypotheses(episodes, state, action, next_state, surprise, predicted)
+
+        # Run self-audit if failure was large
+        if audit:
+            self.audit_activations += 1
+            with self.instrumentation.phase('audit'):
+                self._audit(state, action, next_state)
 
-            best_hyp = None
-            best_gain = 0.0
+    def _search_hypotheses(self, episodes, state, action, next_state, surprise, predicted):
+        # Judge hypotheses on the same window of recent transitions
+        # (including this one) against the current model's error there
+        window = episodes.last(self.hypothesis_window)
+        baseline = _mean(self.world_model.prediction_errors(window))
 
-            for hyp in hypotheses:
-                err = self.causal_library.test_hypothesis(hyp, state, action, world)
-                gain = surprise - err
-                if gain > best_gain:
-                    best_gain = gain
-                    best_hyp = hyp
+        hypotheses = self.causal_library.iter_hypotheses(
+            state, action, surprise, predicted, next_state,
+            window=episodes.last(self.causal_library.fit_window),
+        )
+        # The stream is ranked; score it one group at a time (a type's fitted
+        # estimate, then that type's grid) and stop at the first group whose
+        # best candidate reduces error by at least 20%.
+        groups = groupby(
+            islice(hypotheses, self.max_hypotheses),
+            key=lambda h: (h['type'], h.get('source') == 'fit'),
+        )
+        for _, group in groups:
+            group = list(group)
+            self.hypotheses_tested += len(group)
+            errors = self.causal_library.evaluate_hypotheses(group, window)
 
-            # Accept if it reduces error by at least 20%
-            if best_hyp is not None and best_gain > surprise * 0.2:
+            gains = [baseline - _mean(row) for row in errors]
+            best = max(range(len(group)), key=gains.__getitem__)
+            best_hyp, best_gain = group[best], gains[best]
+            if best_gain > 0.0 and best_gain > baseline * 0.2:
                 if self.causal_library.add_rule(best_hyp):
                     self.learned_rules += 1
-                    print(f"  Learned rule: {best_hyp['type']}")
+                    if self.verbose:
+                        print(f"  Learned rule: {best_hyp['type']}")
+                break
 
-        # Run self-audit if failure was large
-        if self.self_audit.should_activate(surprise):
-            predicted_state, _ = self.world_model.predict(state, action)
-            diagnosis, new_rule = self.self_audit.analyze_failure(
-                state, {}, next_state, predicted_state, action
-            )
-            if new_rule:
-                # ONLY print if rule actually got added (prevents spam)
-                if self.causal_library.add_rule(new_rule):
-                    print(f"  Self-audit added rule: {diagnosis}")
+    def _audit(self, state, action, next_state):
+        # Re-predict under any rule just learned; uncached, since the
+        # prediction cache belongs to the control loop
+        predicted_state, _ = self.world_model.predict(state, action, use_cache=False)
+        diagnosis, new_rule = self.self_audit.analyze_failure(
+            state, {}, next_state, predicted_state, action
+        )
+        if new_rule:
+            # ONLY print if rule actually got added (prevents spam)
+            if self.causal_library.add_rule(new_rule) and self.verbose:
+                print(f"  Self-audit added rule: {diagnosis}")
+
+    def flush_learning(self):
+        """Block until queued background learning has finished (no-op when synchronous)"""
+        if self.learning_worker is not None:
+            self.learning_worker.flush()
+
+    def close(self):
+        """Stop the background learner, if any, after it drains its queue; close any trace file"""
+        if self.learning_worker is not None:
+            self.learning_worker.close()
+        self.instrumentation.close()
 
     def transfer_skill(self, task_id, world):
-        state = world.reset(task_id)
+        state = world.initial_state(task_id)
         goal = world.get_goal(task_id)
 
         steps = 0
         max_steps = 30
+        states, actions = [], []
 
         while steps < max_steps:
             action, _ = self.act(state, goal, world)
-            next_state = world.step(state.copy(), action)
+            next_state = world.step(state, action)
 
             self.learn_from_experience(state, action, next_state, world)
+            states.append(state)
+            actions.append(action)
 
             if world.goal_achieved(next_state, task_id):
-                self.memory.store_skill(task_id, [action])
+                self.memory.store_skill(task_id, actions, states, goal)
                 return True, steps + 1
 
             state = next_state
@@ -109,9 +240,30 @@ class Agent:
         return 'wait'
 
     def get_stats(self):
-        return {
+        stats = {
             'episodes': self.episode_count,
             'rules_learned': self.learned_rules,
             'memory_episodes': len(self.memory.episodes),
             'thinking_level': self.compute_controller.thinking_level,
         }
+        if self.learning_worker is not None:
+            stats['learning_jobs_submitted'] = self.learning_worker.submitted
+            stats['learning_jobs_dropped'] = self.learning_worker.dropped
+        if self.instrumentation.enabled:
+            stats['instrumentation'] = self._instrumentation_stats()
+        return stats
+
+    def _instrumentation_stats(self):
+        report = self.instrumentation.stats()
+        # Counters the components keep anyway, so they cost nothing to collect
+        cache = self.world_model.cache_stats()
+        report['counters'].update({
+            'plan.expansions': self.planner.total_expansions,
+            'predict.calls': self.world_model.predictions,
+            'predict.cache_hits': cache['hits'],
+            'predict.cache_misses': cache['misses'],
+            'plan.reused': self.plans_reused,
+            'hypotheses.tested': self.hypotheses_tested,
+            'audit.activations': self.audit_activations,
+        })
+        return report
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the agent hot paths.
+
+    python bench.py                          # run everything, print a table
+    python bench.py --json out.json          # also save machine-readable results
+    python bench.py --baseline base.json     # compare; exit 1 on regressions
+    python bench.py -k plan --repeat 3       # only benchmarks matching "plan"
+
+Each benchmark is a setup function returning the callable to time. A run
+times `number` calls, `repeat` times, and reports the per-call best, median
+and mean in seconds. Comparison uses the best time (the least noisy) and
+fails a benchmark that is more than `--threshold` slower than its baseline.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from agent import Agent
+from compute_controller import ComputeController
+from memory import Memory
+from reachability_cache import ReachabilityCache
+from trainer import run_episode
+from world import ACTIONS, PhysicsWorld
+
+BENCHMARKS = []
+
+KNOWN_RULES = (
+    {"type": "gravity", "value": 0.3},
+    {"type": "friction", "value": 0.95},
+    {"type": "state_transition", "threshold": 50.0, "new_state": 1},
+    {"type": "state_transition", "threshold": 50.0, "new_state": 2},
+)
+
+
+def benchmark(name, number=1, repeat=5):
+    def register(setup):
+        BENCHMARKS.append((name, setup, number, repeat))
+        return setup
+    return register
+
+
+def _trained_agent(rules=KNOWN_RULES, verbose=False):
+    agent = Agent(verbose=verbose)
+    for rule in rules:
+        agent.memory.store_rule(rule)
+    return agent
+
+
+def _random_transitions(n, seed=0):
+    world = PhysicsWorld()
+    rng = random.Random(seed)
+    state = world.initial_state(1)
+    rows = []
+    for i in range(n):
+        if i % 30 == 0:
+            state = world.initial_state(rng.choice((1, 2)))
+        action = rng.choice(ACTIONS)
+        next_state = world.step(state, action)
+        rows.append((state, action, next_state))
+        state = next_state
+    return rows
+
+
+# ---- world ----
+
+@benchmark("world.step", number=10_000)
+def bench_step():
+    world = PhysicsWorld()
+    state = world.initial_state(1)
+    return lambda: world.step(state, "push_right")
+
+
+@benchmark("world.step_batch[1000]", number=20)
+def bench_step_batch():
+    world = PhysicsWorld()
+    rows = [s for s, _, _ in _random_transitions(1000)]
+    columns = {k: [s[k] for s in rows] for k in rows[0].keys()}
+    actions = [i % len(ACTIONS) for i in range(len(rows))]
+    return lambda: world.step_batch(columns, actions)
+
+
+@benchmark("world.reachability_check[task1]", repeat=3)
+def bench_reachability_task1():
+    world = PhysicsWorld()
+    world.reachability_cache = None  # time the search, not the disk cache
+    return lambda: world.reachability_check(1, max_steps=30, tol=0.55)
+
+
+@benchmark("world.reachability_check[task1,tol=0.50]", repeat=3)
+def bench_reachability_task1_unsat():
+    # The UNSAT certification: the search exhausts ~120k nodes, the bulk of
+    # run_demo's audit time
+    world = PhysicsWorld()
+    world.reachability_cache = None
+    return lambda: world.reachability_check(1, max_steps=30, tol=0.50)
+
+
+@benchmark("world.reachability_check[task2]", repeat=3)
+def bench_reachability_task2():
+    world = PhysicsWorld()
+    world.reachability_cache = None
+    return lambda: world.reachability_check(2, max_steps=30)
+
+
+@benchmark("world.reachability_check[cached]", number=100)
+def bench_reachability_cached():
+    world = PhysicsWorld()
+    # Own directory, reused between runs, so the user's cache isn't touched
+    world.reachability_cache = ReachabilityCache(os.path.join(tempfile.gettempdir(), "marcos-bench-cache"))
+    world.reachability_check(1, max_steps=30, tol=0.55)
+    return lambda: world.reachability_check(1, max_steps=30, tol=0.55)
+
+
+# ---- world model ----
+
+@benchmark("world_model.predict[cold]", number=10_000)
+def bench_predict_cold():
+    model = _trained_agent().world_model
+    state = PhysicsWorld().initial_state(1)
+    cache = model.prediction_cache
+
+    def run():
+        # Miss the cache every call: lookup, compute and insert
+        cache.clear()
+        model.predict(state, "push_right")
+    return run
+
+
+@benchmark("world_model.predict[warm]", number=10_000)
+def bench_predict_warm():
+    model = _trained_agent().world_model
+    state = PhysicsWorld().initial_state(1)
+    model.predict(state, "push_right")
+    return lambda: model.predict(state, "push_right")
+
+
+# ---- planner ----
+
+def _bench_plan(depth):
+    def setup():
+        agent = _trained_agent()
+        world = PhysicsWorld()
+        state, goal = world.initial_state(1), world.get_goal(1)
+        return lambda: agent.planner.plan(state, goal, depth)
+    return setup
+
+
+def _register_plan_benchmarks():
+    # One benchmark per ComputeController thinking level
+    controller = ComputeController()
+    for level in (1, 2, 3):
+        controller.thinking_level = level
+        depth = controller.get_planning_depth()
+        benchmark(f"planner.plan[depth={depth}]", repeat=3)(_bench_plan(depth))
+
+
+_register_plan_benchmarks()
+
+
+# ---- causal library ----
+
+@benchmark("causal_library.evaluate_hypotheses", number=20)
+def bench_evaluate_hypotheses():
+    agent = _trained_agent(rules=())
+    for s, a, ns in _random_transitions(64):
+        agent.memory.store_episode(s, a, ns, True)
+    library = agent.causal_library
+    state, action, next_state = _random_transitions(1)[0]
+    hypotheses = library.generate_hypotheses(state, action, 1.0)
+    window = agent.memory.episodes.last(agent.hypothesis_window)
+    return lambda: library.evaluate_hypotheses(hypotheses, window)
+
+
+@benchmark("causal_library.iter_hypotheses[fit]", number=20)
+def bench_fit_hypotheses():
+    agent = _trained_agent(rules=())
+    for s, a, ns in _random_transitions(256):
+        agent.memory.store_episode(s, a, ns, True)
+    library = agent.causal_library
+    state, action, next_state = _random_transitions(1)[0]
+    return lambda: list(library.iter_hypotheses(state, action, 1.0))
+
+
+# ---- memory ----
+
+@benchmark("memory.store_episode[1000]", number=5)
+def bench_store_episode():
+    rows = _random_transitions(1000)
+
+    def run():
+        memory = Memory()
+        for s, a, ns in rows:
+            memory.store_episode(s, a, ns, True)
+    return run
+
+
+@benchmark("memory.get_similar_episodes", number=200)
+def bench_similar_episodes():
+    memory = Memory()
+    rows = _random_transitions(1000)
+    for s, a, ns in rows:
+        memory.store_episode(s, a, ns, True)
+    queries = iter([ns for _, _, ns in rows] * 100)
+    return lambda: memory.get_similar_episodes(next(queries), k=5)
+
+
+# ---- end to end ----
+
+@benchmark("demo.learning_phase", repeat=3)
+def bench_learning_phase():
+    # run_demo's learning phase: 50 Task 1 episodes from a blank agent
+    def run():
+        agent = Agent(verbose=False)
+        world = PhysicsWorld()
+        for _ in range(50):
+            run_episode(agent, world, 1, max_steps=30, tol=0.55)
+            agent.episode_count += 1
+    return run
+
+
+def run_benchmarks(pattern=None, repeat=None):
+    """Run the registered benchmarks whose name contains `pattern`; returns {name: result}"""
+    results = {}
+    for name, setup, number, default_repeat in BENCHMARKS:
+        if pattern and pattern not in name:
+            continue
+        fn = setup()
+        times = []
+        for _ in range(repeat or default_repeat):
+            t0 = time.perf_counter()
+            for _ in range(number):
+                fn()
+            times.append((time.perf_counter() - t0) / number)
+        results[name] = {
+            "best": min(times),
+            "median": statistics.median(times),
+            "mean": statistics.fmean(times),
+            "number": number,
+            "repeat": len(times),
+        }
+    return results
+
+
+def compare(results, baseline, threshold=0.25):
+    """
+    Compare best times with a baseline's. Returns rows of
+    (name, baseline_best, best, ratio, ok); a benchmark the baseline doesn't
+    have gets None for baseline_best and ratio, and passes.
+    """
+    rows = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            rows.append((name, None, result["best"], None, True))
+            continue
+        ratio = result["best"] / base["best"] if base["best"] > 0 else None
+        ok = ratio is None or ratio <= 1.0 + threshold
+        rows.append((name, base["best"], result["best"], ratio, ok))
+    return rows
+
+
+def _fmt_time(seconds):
+    if seconds is None:
+        return "-"
+    for unit, scale in (("s", 1.0), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", dest="pattern", help="only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, help="override every benchmark's repeat count")
+    parser.add_argument("--json", dest="json_path", help="write results to this file")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed slowdown vs baseline before failing (default 0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.pattern, args.repeat)
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "results": results,
+            }, f, indent=2)
+
+    if not args.baseline:
+        for name, r in results.items():
+            print(f"{name:40s} best {_fmt_time(r['best']):>10s}  median {_fmt_time(r['median']):>10s}")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+
+    failed = 0
+    for name, base, best, ratio, ok in compare(results, baseline, args.threshold):
+        change = "new" if ratio is None else f"{ratio:.2f}x"
+        flag = "" if ok else "  REGRESSION"
+        print(f"{name:40s} {_fmt_time(base):>10s} -> {_fmt_time(best):>10s}  {change:>6s}{flag}")
+        failed += not ok
+    if failed:
+        print(f"\n{failed} benchmark(s) slower than baseline by more than {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,17 @@
+from array import array
+from itertools import chain, islice
+
+from rule_fitter import RuleFitter
+from state import State
+from world import ACTION_EFFECTS, ACTION_INDEX
+
 class CausalLibrary:
     """Generates and tests causal hypotheses"""
 
-    def __init__(self, memory):
+    def __init__(self, memory, fit_window=256):
         self.memory = memory
+        self.fitter = RuleFitter()
+        self.fit_window = fit_window  # recent transitions the closed-form fits use
 
         # Expanded hypothesis templates with better coverage
         self.templates = [
@@ -28,74 +37,134 @@ class CausalLibrary:
             {'type': 'state_transition', 'threshold': 60.0, 'new_state': 2, 'test_range': [30, 40, 50, 60]},
         ]
 
-    def generate_hypotheses(self, state, action, surprise):
-        """Generate causal hypotheses when surprised"""
-        hypotheses = []
-
-        for template in self.templates:
-            if self._rule_exists(template):
-                continue
-
-            for val in template.get('test_range', [template.get('value')]):
-                hyp = template.copy()
-                if 'value' in hyp:
-                    hyp['value'] = float(val)
-                if 'threshold' in hyp:
-                    hyp['threshold'] = float(val)
-                hypotheses.append(hyp)
-
-        return hypotheses[:15]
+    def generate_hypotheses(self, state, action, surprise, predicted=None, observed=None):
+        """Generate causal hypotheses when surprised (first 15 of iter_hypotheses)"""
+        return list(islice(self.iter_hypotheses(state, action, surprise, predicted, observed), 15))
+
+    def iter_hypotheses(self, state, action, surprise, predicted=None, observed=None, window=None):
+        """
+        Lazily yield candidate rules, most plausible first and never twice.
+
+        Rule types are ordered by how much of the prediction error between
+        `predicted` and `observed` they could explain (velocity vs discrete
+        state components); types that explain none of it are skipped. Within a
+        type, closed-form fits over recent transitions come before the template
+        grid. Candidates memory already has are skipped. Fitting only runs once
+        the first candidate is requested, over `window` (default: the newest
+        fit_window episodes in memory).
+        """
+        fitted = None
+        seen = set()
+
+        for rule_type in self._rank_rule_types(predicted, observed):
+            if fitted is None:
+                if window is None:
+                    window = self.memory.episodes.last(self.fit_window)
+                fitted = self.fitter.fit(window)
+            candidates = chain(
+                (h for h in fitted if h['type'] == rule_type),
+                (h for h in self._grid_hypotheses() if h['type'] == rule_type),
+            )
+            for hyp in candidates:
+                key = self._hypothesis_key(hyp)
+                if key in seen:
+                    continue
+                seen.add(key)
+                if self._rule_exists(hyp):
+                    continue
+                yield hyp
 
     def test_hypothesis(self, hypothesis, state, action, world):
         """Test hypothesis in mental simulation"""
-        test_state = state.copy()
+        state = State.coerce(state)
+        x, y, vx, vy, temp, st = state
 
         # Apply action
-        if action == 'push_right':
-            test_state['vx'] += 1.0
-        elif action == 'push_left':
-            test_state['vx'] -= 1.0
-        elif action == 'heat':
-            test_state['temp'] += 15.0
-        elif action == 'cool':
-            test_state['temp'] -= 15.0
-        elif action == 'wait':
-            pass
+        i = ACTION_INDEX.get(action)
+        if i is not None:
+            dvx, dtemp = ACTION_EFFECTS[i]
+            vx += dvx
+            temp += dtemp
 
         # Apply hypothesis
-        test_state = self._apply_rule(test_state, hypothesis)
+        test_state = self._apply_rule(State(x, y, vx, vy, temp, st), hypothesis)
 
         # Update position
-        test_state['x'] += test_state['vx']
-        test_state['y'] += test_state['vy']
+        test_state = test_state.replace(x=x + test_state.vx, y=y + test_state.vy)
 
-        actual_state = world.step(state.copy(), action)
+        actual_state = world.step(state, action)
         return self._calculate_error(test_state, actual_state)
 
+    def evaluate_hypotheses(self, hypotheses, window=None, window_size=32):
+        """
+        Score every hypothesis against a window of stored transitions in one pass.
+
+        Returns an error matrix: one array('d') row per hypothesis, one column per
+        transition in `window` (default: the newest `window_size` episodes in
+        memory). Each entry is the error test_hypothesis would report, but
+        measured against the observed next state instead of re-stepping a world.
+        """
+        if window is None:
+            window = self.memory.episodes.last(window_size)
+
+        # Post-action states, shared by all hypotheses
+        base = []
+        for (x, y, vx, vy, temp, st), a in zip(window.states(), window.actions()):
+            dvx, dtemp = ACTION_EFFECTS[a]
+            base.append((x, y, vx + dvx, vy, temp + dtemp, st))
+        observed = list(window.next_states())
+
+        matrix = []
+        for hyp in hypotheses:
+            t = hyp.get('type')
+            value = hyp.get('value', 0.0)
+            threshold = hyp.get('threshold', 0.0)
+            new_state = hyp.get('new_state')
+
+            row = array('d')
+            for (x, y, vx, vy, temp, st), (ax, ay, avx, avy, atemp, ast) in zip(base, observed):
+                if t == 'gravity':
+                    vy -= value
+                elif t == 'friction':
+                    vx *= value
+                    vy *= value
+                elif t == 'state_transition':
+                    if temp > threshold:
+                        st = new_state
+                row.append(
+                    abs(x + vx - ax) + abs(y + vy - ay) + abs(vx - avx) + abs(vy - avy)
+                    + abs(temp - atemp) + abs(st - ast) * 2.0
+                )
+            matrix.append(row)
+
+        return matrix
+
     def add_rule(self, rule):
         """Add validated rule to memory"""
         return self.memory.store_rule(rule)
 
     def apply_rules(self, state):
-        result = state.copy()
+        result = State.coerce(state)
         for rule in self.memory.get_rules():
             result = self._apply_rule(result, rule)
         return result
 
     def _apply_rule(self, state, rule):
-        s = state.copy()
+        x, y, vx, vy, temp, st = state
         t = rule.get('type')
 
         if t == 'gravity':
-            s['vy'] -= rule['value']
+            vy -= rule['value']
         elif t == 'friction':
-            s['vx'] *= rule['value']
-            s['vy'] *= rule['value']
+            vx *= rule['value']
+            vy *= rule['value']
         elif t == 'state_transition':
-            if s['temp'] > rule['threshold']:
-                s['state'] = rule['new_state']
+            if temp > rule['threshold']:
+                st = rule['new_state']
+        else:
+            return state
 
-        return s
+        return State(x, y, vx, vy, temp, st)
 
     def _calculate_error(self, pred, actual):
         error = 0.0
@@ -104,23 +173,38 @@ class CausalLibrary:
         error += abs(pred['state'] - actual['state']) * 2.0
         return error
 
+    def _rank_rule_types(self, predicted, observed):
+        order = ['gravity', 'friction', 'state_transition']
+        if predicted is None or observed is None:
+            return order
+
+        dvx = abs(predicted['vx'] - observed['vx'])
+        dvy = abs(predicted['vy'] - observed['vy'])
+        dstate = abs(predicted['state'] - observed['state'])
+
+        # Gravity only moves vy, friction scales both velocities, and a discrete
+        # state change needs a transition rule. Position errors follow from
+        # velocity errors, so on their own (e.g. bounds clamping) no rule type
+        # can explain them.
+        score = {
+            'gravity': dvy,
+            'friction': dvx + dvy,
+            'state_transition': 2.0 * dstate,
+        }
+        return sorted((t for t in order if score[t] > 1e-9), key=lambda t: -score[t])
+
+    def _grid_hypotheses(self):
+        for template in self.templates:
+            for val in template.get('test_range', [template.get('value')]):
+                hyp = template.copy()
+                if 'value' in hyp:
+                    hyp['value'] = float(val)
+                if 'threshold' in hyp:
+                    hyp['threshold'] = float(val)
+                yield hyp
+
+    def _hypothesis_key(self, hyp):
+        return tuple(sorted(self.memory._canonicalize_rule(hyp).items()))
+
     def _rule_exists(self, rule):
-        existing = self.memory.get_rules()
-
-        for r in existing:
-            if r.get('type') != rule.get('type'):
-                continue
-
-            t = r.get('type')
-            if t == 'gravity':
-                if abs(r['value'] - rule.get('value', r['value'])) < 0.05:
-                    return True
-            elif t == 'friction':
-                if abs(r['value'] - rule.get('value', r['value'])) < 0.01:
-                    return True
-            elif t == 'state_transition':
-                if (abs(r['threshold'] - rule.get('threshold', r['threshold'])) < 5.0 and
-                    r.get('new_state') == rule.get('new_state')):
-                    return True
-
-        return False
+        return self.memory.contains_rule(rule)
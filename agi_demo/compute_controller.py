@@ -1,10 +1,22 @@
+# Share of the latency budget planning may use at each thinking level
+_BUDGET_SHARE = {1: 0.25, 2: 0.5, 3: 1.0}
+
+
 class ComputeController:
     """Controls computational effort based on confidence"""
 
-    def __init__(self):
+    def __init__(self, latency_budget=None, smoothing=0.2):
         self.thinking_level = 1  # 1=minimal, 3=deep
         self.confidence_history = []
 
+        # Latency-budget mode: seconds per act() for planning, or None for
+        # fixed depths only. The planner checks its deadline between node
+        # expansions, so it overruns by up to one expansion; the running
+        # average of that overrun is held back from the next deadline.
+        self.latency_budget = latency_budget
+        self.smoothing = smoothing
+        self.overrun_avg = 0.0
+
     def adjust_thinking(self, confidence):
         self.confidence_history.append(float(confidence))
         if len(self.confidence_history) > 10:
@@ -22,7 +34,20 @@ class ComputeController:
         return self.thinking_level
 
     def get_planning_depth(self):
+        if self.latency_budget is not None:
+            return 15  # the deadline, not the depth, bounds the search
         return {1: 5, 2: 10, 3: 15}[self.thinking_level]
 
+    def plan_budget(self):
+        """Seconds planning may take at the current thinking level (None without a budget)"""
+        if self.latency_budget is None:
+            return None
+        budget = self.latency_budget * _BUDGET_SHARE[self.thinking_level]
+        return max(0.0, budget - self.overrun_avg)
+
+    def record_plan_time(self, seconds, budget):
+        """Fold one observed plan duration's overrun of `budget` into the average"""
+        self.overrun_avg += self.smoothing * (max(0.0, seconds - budget) - self.overrun_avg)
+
     def should_generate_hypotheses(self, surprise):
         return float(surprise) > 0.7 or self.thinking_level == 3
@@ -0,0 +1,140 @@
+import math
+from heapq import heappush, heappushpop
+from itertools import product
+from operator import add
+
+
+class EpisodeIndex:
+    """
+    Incremental k-nearest-neighbour index over stored episode states.
+
+    States are normalized per field by `scales` (one unit = one "similar enough"
+    step in that field) and bucketed into a uniform grid of unit cells. A query
+    visits cells in growing shells (Chebyshev rings) around the query's cell
+    and stops as soon as the next shell's lower-bound distance can't beat the
+    current k-th neighbour, so in a dense grid a query only touches the cells
+    near it. Shells grow as (2r+1)^6, so once the next one would be large
+    compared with the occupied cells not yet seen, those cells are instead
+    sorted by lower bound and scanned until none can beat the k-th neighbour;
+    on a sparse grid that fallback costs O(C log C) in the occupied cells C.
+    """
+
+    # x, y, vx, vy, temp, state; a differing discrete state counts as 4 units
+    DEFAULT_SCALES = (1.0, 1.0, 0.5, 0.5, 5.0, 0.25)
+
+    def __init__(self, scales=DEFAULT_SCALES):
+        self.scales = tuple(scales)
+        self.cells = {}   # cell -> {slot: normalized point}
+        self._cell_of = {}  # slot -> cell
+
+    def __len__(self):
+        return len(self._cell_of)
+
+    def add(self, slot, state):
+        if slot in self._cell_of:
+            self.remove(slot)
+        point = self._normalize(state)
+        cell = tuple(math.floor(v) for v in point)
+        self.cells.setdefault(cell, {})[slot] = point
+        self._cell_of[slot] = cell
+
+    def remove(self, slot):
+        cell = self._cell_of.pop(slot, None)
+        if cell is None:
+            return
+        members = self.cells[cell]
+        del members[slot]
+        if not members:
+            del self.cells[cell]
+
+    def query(self, state, k=5):
+        """Return up to k (distance, slot) pairs, nearest first"""
+        if k <= 0:
+            return []
+        q = self._normalize(state)
+        center = tuple(math.floor(v) for v in q)
+        # Gap from q to the nearest face of its own cell; every cell in shell r
+        # is at least (r - 1 + margin) away
+        margin = min(min(v - c, c + 1 - v) for v, c in zip(q, center))
+
+        best = []  # max-heap via negated squared distance
+        cells = self.cells
+        seen = set()
+        r = 0
+        while len(seen) < len(cells):
+            if len(best) == k and r > 0 and (r - 1 + margin) ** 2 >= -best[0][0]:
+                return _sorted(best)
+            offsets = _shell_offsets(len(q), r)
+            if len(offsets) > _SHELL_RATIO * (len(cells) - len(seen)):
+                break
+            for offset in offsets:
+                cell = tuple(map(add, center, offset))
+                members = cells.get(cell)
+                if members is None:
+                    continue
+                seen.add(cell)
+                if len(best) < k or self._cell_bound(q, cell) < -best[0][0]:
+                    self._scan(q, members, k, best)
+            r += 1
+
+        # Sparse grid: walking the next shell would cost more than ranking the
+        # remaining occupied cells, so visit those by lower bound instead
+        bounds = sorted((self._cell_bound(q, cell), cell) for cell in cells if cell not in seen)
+        for bound, cell in bounds:
+            if len(best) == k and bound >= -best[0][0]:
+                break
+            self._scan(q, cells[cell], k, best)
+        return _sorted(best)
+
+    def _scan(self, q, members, k, best):
+        for slot, point in members.items():
+            d2 = 0.0
+            for a, b in zip(q, point):
+                d2 += (a - b) * (a - b)
+            item = (-d2, -slot)
+            if len(best) < k:
+                heappush(best, item)
+            elif item > best[0]:
+                heappushpop(best, item)
+
+    def _normalize(self, state):
+        return tuple(v / s for v, s in zip(state, self.scales))
+
+    def _cell_bound(self, q, cell):
+        # Squared distance from q to the closest point of the unit cell box
+        d2 = 0.0
+        for v, c in zip(q, cell):
+            if v < c:
+                d2 += (c - v) * (c - v)
+            elif v > c + 1:
+                d2 += (v - c - 1) * (v - c - 1)
+        return d2
+
+
+
+# Walk a shell only while it has at most this many cells per occupied cell left
+_SHELL_RATIO = 0.25
+_SHELLS = {}
+
+
+def _shell_offsets(dims, r):
+    # Offsets at Chebyshev distance exactly r, each once: dimension i is the
+    # first at +-r, earlier ones are strictly inside the ring
+    offsets = _SHELLS.get((dims, r))
+    if offsets is None:
+        if r == 0:
+            offsets = ((0,) * dims,)
+        else:
+            inner = range(-r + 1, r)
+            full = range(-r, r + 1)
+            offsets = tuple(
+                offset
+                for i in range(dims)
+                for offset in product(*([inner] * i + [(-r, r)] + [full] * (dims - i - 1)))
+            )
+        _SHELLS[dims, r] = offsets
+    return offsets
+
+
+def _sorted(best):
+    return [(math.sqrt(-d2), -neg_slot) for d2, neg_slot in sorted(best, reverse=True)]
@@ -0,0 +1,154 @@
+from array import array
+from itertools import chain
+
+from state import FIELDS, State
+from world import ACTIONS, ACTION_INDEX
+
+NEXT_FIELDS = tuple("next_" + k for k in FIELDS)
+
+# Column name -> array typecode
+COLUMNS = (
+    tuple((k, "b" if k == "state" else "d") for k in FIELDS)
+    + (("action", "b"),)
+    + tuple((k, "b" if k == "next_state" else "d") for k in NEXT_FIELDS)
+    + (("success", "b"), ("hash", "q"))
+)
+
+
+class EpisodeStore:
+    """
+    Fixed-capacity ring buffer of transitions stored column-wise.
+
+    Every column is preallocated once as a typed array, so appending is O(1)
+    and never reallocates; once full, the oldest transition is overwritten.
+    Index 0 is the oldest stored transition, -1 the newest.
+    """
+
+    def __init__(self, capacity=1000):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self.columns = {
+            name: array(code, bytes(array(code).itemsize * capacity)) for name, code in COLUMNS
+        }
+        self.head = 0  # physical slot of the next write
+        self.size = 0
+
+    @classmethod
+    def from_columns(cls, columns, capacity, size, head):
+        """
+        Wrap existing column buffers (arrays or memoryviews cast to each
+        column's typecode, e.g. over an mmap) without copying them.
+        """
+        store = cls.__new__(cls)
+        store.capacity = capacity
+        store.columns = {name: columns[name] for name, _ in COLUMNS}
+        store.size = size
+        store.head = head
+        return store
+
+    def append(self, state, action, next_state, success, state_hash):
+        """Store one transition, returning the physical slot it was written to"""
+        slot = self.head
+        cols = self.columns
+        for name, value in zip(FIELDS, state):
+            cols[name][slot] = value
+        cols["action"][slot] = ACTION_INDEX[action]
+        for name, value in zip(NEXT_FIELDS, next_state):
+            cols[name][slot] = value
+        cols["success"][slot] = 1 if success else 0
+        cols["hash"][slot] = state_hash
+
+        self.head = (slot + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+        return slot
+
+    def __len__(self):
+        return self.size
+
+    def slot(self, i):
+        """Physical slot of logical index i (0 = oldest, -1 = newest)"""
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError("episode index out of range")
+        return (self.head - self.size + i) % self.capacity
+
+    def __getitem__(self, i):
+        return self.record(self.slot(i))
+
+    def __iter__(self):
+        return iter(self.last(self.size))
+
+    def record(self, slot):
+        """Materialize the transition in a physical slot as an episode dict"""
+        cols = self.columns
+        return {
+            "state": State(*(cols[k][slot] for k in FIELDS)),
+            "action": ACTIONS[cols["action"][slot]],
+            "next_state": State(*(cols[k][slot] for k in NEXT_FIELDS)),
+            "success": bool(cols["success"][slot]),
+            "hash": cols["hash"][slot],
+        }
+
+    def last(self, n):
+        """Zero-copy window over the newest n transitions (oldest first)"""
+        n = max(0, min(n, self.size))
+        return EpisodeWindow(self, (self.head - n) % self.capacity, n)
+
+
+class EpisodeWindow:
+    """
+    View over consecutive ring slots. Columns are exposed as memoryview
+    segments into the store's arrays (two when the window wraps around), so
+    nothing is copied until rows are actually read.
+    """
+
+    def __init__(self, store, start, n):
+        self.store = store
+        self.start = start
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    def segments(self, name):
+        col = memoryview(self.store.columns[name])
+        end = self.start + self.n
+        if end <= self.store.capacity:
+            return (col[self.start:end],)
+        return (col[self.start:], col[: end - self.store.capacity])
+
+    def column(self, name):
+        return chain.from_iterable(self.segments(name))
+
+    def slots(self):
+        cap = self.store.capacity
+        return ((self.start + i) % cap for i in range(self.n))
+
+    def snapshot(self):
+        """Copy this window into its own EpisodeStore, detached from the source ring"""
+        store = EpisodeStore(max(self.n, 1))
+        for name, _ in COLUMNS:
+            dest = memoryview(store.columns[name])
+            i = 0
+            for seg in self.segments(name):
+                dest[i:i + len(seg)] = seg
+                i += len(seg)
+        store.size = self.n
+        store.head = self.n % store.capacity
+        return store
+
+    def states(self):
+        return map(State, *(self.column(k) for k in FIELDS))
+
+    def next_states(self):
+        return map(State, *(self.column(k) for k in NEXT_FIELDS))
+
+    def actions(self):
+        return self.column("action")
+
+    def __iter__(self):
+        record = self.store.record
+        return (record(slot) for slot in self.slots())
@@ -0,0 +1,143 @@
+import json
+import threading
+import time
+
+
+class Instrumentation:
+    """
+    Per-phase timers and event counters for the agent's hot paths.
+
+    Disabled (the default), phase() hands back one shared no-op context
+    manager and count() returns straight away, so instrumented code pays
+    about one method call per phase. Enabled, every phase records its
+    duration into a log2 latency histogram (1us, 2us, 4us, ... buckets) and,
+    with a trace_path, appends one event per phase to a trace file: JSON
+    lines by default, or a Chrome trace (chrome://tracing, Perfetto) with
+    trace_format="chrome".
+    """
+
+    def __init__(self, enabled=False, trace_path=None, trace_format="jsonl"):
+        if trace_format not in ("jsonl", "chrome"):
+            raise ValueError("trace_format must be 'jsonl' or 'chrome'")
+        self.enabled = enabled
+        self.counters = {}
+        self.phases = {}  # name -> [calls, total seconds, max seconds, histogram list]
+        self.trace_path = trace_path
+        self.trace_format = trace_format
+        self._trace = None
+        self._trace_events = 0
+        self._trace_closed = False
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    def phase(self, name):
+        """Context manager timing one occurrence of a phase"""
+        if not self.enabled:
+            return _NULL_PHASE
+        return _Phase(self, name)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def instrument_world(self, world):
+        """Count world.step calls (and step_batch rows) on a PhysicsWorld"""
+        world.instrumentation = self
+
+    def record(self, name, start, seconds):
+        with self._lock:
+            entry = self.phases.get(name)
+            if entry is None:
+                entry = self.phases[name] = [0, 0.0, 0.0, []]
+            entry[0] += 1
+            entry[1] += seconds
+            if seconds > entry[2]:
+                entry[2] = seconds
+            bucket = int(seconds * 1e6).bit_length()  # 0: <1us, b: <2**b us
+            hist = entry[3]
+            if bucket >= len(hist):
+                hist.extend([0] * (bucket + 1 - len(hist)))
+            hist[bucket] += 1
+
+            if self.trace_path is not None:
+                self._write_event(name, start, seconds)
+
+    def stats(self):
+        """Counters and per-phase latency summaries, JSON-serializable"""
+        phases = {}
+        for name, (calls, total, longest, hist) in sorted(self.phases.items()):
+            phases[name] = {
+                'calls': calls,
+                'total_s': total,
+                'mean_us': total / calls * 1e6,
+                'max_us': longest * 1e6,
+                'histogram_us': {f"<{1 << b}": n for b, n in enumerate(hist) if n},
+            }
+        return {'counters': dict(sorted(self.counters.items())), 'phases': phases}
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.phases.clear()
+
+    def close(self):
+        """
+        Finish and close the trace file, if one is open. Phases recorded
+        afterwards are still timed but no longer traced, so the finished file
+        is never truncated or extended.
+        """
+        with self._lock:
+            self._trace_closed = True
+            if self._trace is None:
+                return
+            if self.trace_format == "chrome":
+                self._trace.write("\n]\n")
+            self._trace.close()
+            self._trace = None
+
+    def _write_event(self, name, start, seconds):
+        # Caller holds self._lock
+        if self._trace_closed:
+            return
+        if self._trace is None:
+            self._trace = open(self.trace_path, "w")
+            if self.trace_format == "chrome":
+                self._trace.write("[\n")
+        ts = (start - self._origin) * 1e6
+        tid = threading.get_ident()
+        if self.trace_format == "chrome":
+            event = {'name': name, 'ph': 'X', 'ts': ts, 'dur': seconds * 1e6, 'pid': 0, 'tid': tid}
+            self._trace.write((",\n" if self._trace_events else "") + json.dumps(event))
+        else:
+            event = {'name': name, 'ts_us': ts, 'dur_us': seconds * 1e6, 'tid': tid}
+            self._trace.write(json.dumps(event) + "\n")
+        self._trace_events += 1
+
+
+class _Phase:
+    __slots__ = ("instrumentation", "name", "start")
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.instrumentation.record(self.name, self.start, time.perf_counter() - self.start)
+        return False
+
+
+class _NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
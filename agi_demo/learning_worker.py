@@ -0,0 +1,61 @@
+import queue
+import threading
+
+_STOP = object()
+
+
+class LearningWorker:
+    """
+    Runs learning jobs on a background thread, off the control loop.
+
+    Jobs go onto a bounded queue; when it is full the new job is dropped (and
+    counted) rather than blocking the caller. flush() is a barrier: it returns
+    once every submitted job has finished, re-raising the first error a job
+    raised, so callers that flush after each step stay deterministic.
+    """
+
+    def __init__(self, handler, max_pending=64):
+        self.handler = handler
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.submitted = 0
+        self.dropped = 0
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="learning-worker", daemon=True)
+        self._thread.start()
+
+    def submit(self, *job):
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.submitted += 1
+        return True
+
+    def flush(self):
+        self.queue.join()
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def close(self):
+        if not self._thread.is_alive():
+            return
+        self.queue.put(_STOP)
+        self._thread.join()
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is _STOP:
+                    return
+                self.handler(*job)
+            except Exception as e:
+                if self._error is None:
+                    self._error = e
+            finally:
+                self.queue.task_done()
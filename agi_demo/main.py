@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 from world import PhysicsWorld
 from agent import Agent
+from trainer import run_episode
 
 def _fmt_rule(rule: dict) -> str:
     t = rule.get("type", "unknown")
@@ -25,8 +26,9 @@ def run_demo():
     # Spec audit (Task 1)
     print("\n0. SPEC REACHABILITY AUDIT (Task 1)")
     print("-" * 60)
-    r0, p0, e0 = world.reachability_check(1, max_steps=30, tol=0.50)
-    r1, p1, e1 = world.reachability_check(1, max_steps=30, tol=0.55)
+    audit = world.reachability_sweep([1], [0.50, 0.55], [30])
+    r0, p0, e0 = audit[(1, 0.50, 30)]
+    r1, p1, e1 = audit[(1, 0.55, 30)]
 
     print(f"tol=0.50 reachable: {r0} | expanded: {e0} | witness_len: {len(p0)}")
     print(f"tol=0.55 reachable: {r1} | expanded: {e1} | witness_len: {len(p1)}")
@@ -50,21 +52,9 @@ def run_demo():
     episodes = 50
 
     for episode in range(episodes):
-        state = world.reset(1)
-        goal = world.get_goal(1)
-
-        for step in range(30):
-            action, _ = agent.act(state, goal, world)
-            next_state = world.step(state.copy(), action)
-
-            agent.learn_from_experience(state, action, next_state, world)
-
-            if world.goal_achieved(next_state, 1, tol=0.55):
-                success_count += 1
-                state = next_state
-                break
-
-            state = next_state
+        success, _ = run_episode(agent, world, 1, max_steps=30, tol=0.55)
+        if success:
+            success_count += 1
 
         agent.episode_count += 1
 
@@ -78,13 +68,13 @@ def run_demo():
     print("\n2. PLANNING TEST (Task 1, tol=0.55)")
     print("-" * 60)
 
-    state = world.reset(1)
+    state = world.initial_state(1)
     goal = world.get_goal(1)
     steps = 0
 
     while steps < 30:
         action, _ = agent.act(state, goal, world)
-        state = world.step(state.copy(), action)
+        state = world.step(state, action)
         steps += 1
 
         if world.goal_achieved(state, 1, tol=0.55):
@@ -1,45 +1,97 @@
 import json
-import hashlib
+import math
+import mmap as mmap_module
+import os
+import struct
+import sys
+import threading
+from array import array
+from types import MappingProxyType
+
+from episode_index import EpisodeIndex
+from episode_store import COLUMNS, EpisodeStore
+from skill_library import SkillLibrary
+from state import State
+from state_hash import EXACT, StateHasher
+
+_SNAPSHOT_MAGIC = b'MARCOSMEM\x00'
+_SNAPSHOT_VERSION = 2  # 2: skills saved as SkillLibrary records
+
+
+def _align(n, to=8):
+    return (n + to - 1) // to * to
+
 
 class Memory:
     """Episodic memory + rule storage (with semantic canonicalization + tolerance de-dupe)."""
 
-    def __init__(self):
-        self.episodes = []
-        self.rules = []
-        self.skills = {}  # task_id -> successful action sequence
+    def __init__(self, episode_capacity=1000, state_hasher=EXACT):
+        self.state_hasher = state_hasher  # key stored in the episode 'hash' column
+        self.episodes = EpisodeStore(episode_capacity)
+        self._episode_index = EpisodeIndex()  # k-NN over episode start states, built lazily after load()
+        self._mmap = None  # keeps a load(mmap=True) mapping alive
+        # Guards writers (and snapshot readers) when a background learner runs
+        self._lock = threading.RLock()
+        # Immutable snapshot: a tuple of read-only rule mappings, replaced (never
+        # mutated) on every accepted rule, so callers can hold it without copying.
+        self.rules = ()
+        self.rule_version = 0  # bumped whenever the rule set changes
+        self._rule_snapshot = (0, ())  # (rule_version, rules), published as one object
+        self._rule_index = {}  # dedupe bucket -> canonical rules in that bucket
+        self.skills = SkillLibrary()  # successful trajectories, by task and by (region, goal)
 
     # -------------------------
     # Episodes / skills
     # -------------------------
     def store_episode(self, state, action, next_state, success):
-        episode = {
-            'state': state.copy(),
-            'action': action,
-            'next_state': next_state.copy(),
-            'success': bool(success),
-            'hash': self._state_hash(state),
-        }
-        self.episodes.append(episode)
-        if len(self.episodes) > 1000:
-            self.episodes = self.episodes[-1000:]
+        state = State.coerce(state)
+        next_state = State.coerce(next_state)
+        state_hash = self._state_hash(state)
+        with self._lock:
+            store = self.episodes
+            index = self._episode_index
+            if index is not None and len(store) == store.capacity:
+                index.remove(store.head)  # about to be overwritten
+            slot = store.append(state, action, next_state, success, state_hash)
+            if index is not None:
+                index.add(slot, state)
+
+    def episode_snapshot(self, n):
+        """Private copy of the newest n episodes, safe to read from another thread"""
+        with self._lock:
+            return self.episodes.last(n).snapshot()
 
     def get_similar_episodes(self, state, k=5):
-        if not self.episodes:
-            return []
-        target_hash = self._state_hash(state)
-        scored = []
-        for ep in self.episodes[-100:]:
-            sim = 1.0 if ep['hash'] == target_hash else 0.0
-            scored.append((sim, ep))
-        scored.sort(key=lambda x: x[0], reverse=True)
-        return [ep for _, ep in scored[:k]]
-
-    def store_skill(self, task_id, action_sequence):
-        self.skills[task_id] = list(action_sequence)
+        """Up to k stored episodes whose start state is nearest to `state`, nearest first"""
+        episodes = []
+        for distance, slot in self.episode_index.query(State.coerce(state), k):
+            ep = self.episodes.record(slot)
+            ep['distance'] = distance
+            episodes.append(ep)
+        return episodes
+
+    @property
+    def episode_index(self):
+        if self._episode_index is None:
+            index = EpisodeIndex()
+            for slot in self.episodes.last(len(self.episodes)).slots():
+                index.add(slot, self.episodes.record(slot)['state'])
+            self._episode_index = index
+        return self._episode_index
+
+    def store_skill(self, task_id, action_sequence, states=None, goal=None):
+        """
+        Record a successful action sequence for a task (the shortest one per
+        task is kept). With the states it was taken from and the goal it
+        reached, every suffix is also indexed for use as a planner macro.
+        """
+        with self._lock:
+            if states is None or goal is None:
+                return self.skills.add(task_id, action_sequence)
+            return self.skills.add_trajectory(task_id, states, action_sequence, goal)
 
     def get_skill(self, task_id):
-        return self.skills.get(task_id, None)
+        return self.skills.best_for_task(task_id)
 
     # -------------------------
     # Rules (canonical + dedupe)
@@ -51,23 +103,130 @@ class Memory:
         don't create duplicates.
         """
         canonical = self._canonicalize_rule(rule)
-
-        for existing in self.rules:
-            if self._rules_equal(canonical, existing):
+        with self._lock:
+            if self._find_equal_rule(canonical) is not None:
                 return False
 
-        self.rules.append(canonical)
-        return True
+            self._rule_index.setdefault(self._rule_bucket(canonical), []).append(canonical)
+            # Publish the new snapshot before its version, so a reader that sees
+            # the new version always sees the new rules
+            self.rules = self.rules + (MappingProxyType(canonical),)
+            self.rule_version += 1
+            self._rule_snapshot = (self.rule_version, self.rules)
+            return True
 
     def get_rules(self):
-        return [r.copy() for r in self.rules]
+        """Current rule snapshot (read-only; safe to keep, never changes in place)"""
+        return self.rules
+
+    def rule_snapshot(self):
+        """(rule_version, rules) as one consistent pair, safe to read from any thread"""
+        return self._rule_snapshot
+
+    def contains_rule(self, rule):
+        """True if a semantic duplicate of `rule` is already stored"""
+        return self._find_equal_rule(self._canonicalize_rule(rule)) is not None
+
+    # -------------------------
+    # Snapshots
+    # -------------------------
+    def save(self, path):
+        """
+        Write a binary snapshot: magic, format version and a small JSON header
+        (rules, skills, episode ring layout) followed by the raw episode
+        columns, each 8-byte aligned so load() can map them in place.
+        """
+        store = self.episodes
+        layout = []
+        offset = 0
+        for name, code in COLUMNS:
+            nbytes = store.capacity * array(code).itemsize
+            layout.append([name, code, offset, nbytes])
+            offset += _align(nbytes)
+
+        header = json.dumps({
+            'byteorder': sys.byteorder,
+            'rules': [dict(r) for r in self.rules],
+            'skills': self.skills.to_records(),
+            'state_hasher': self.state_hasher.widths,
+            'episodes': {
+                'capacity': store.capacity,
+                'size': store.size,
+                'head': store.head,
+                'columns': layout,
+            },
+        }).encode()
+        prefix = _SNAPSHOT_MAGIC + struct.pack('<II', _SNAPSHOT_VERSION, len(header)) + header
+
+        with open(path, 'wb') as f:
+            f.write(prefix)
+            f.write(bytes(_align(len(prefix)) - len(prefix)))
+            for name, code, _, nbytes in layout:
+                f.write(memoryview(store.columns[name]).cast('B'))
+                f.write(bytes(_align(nbytes) - nbytes))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Restore a snapshot written by save(). With mmap=True the episode columns
+        are copy-on-write views of the file's pages: loading costs no copying,
+        read-only pages are shared with other processes through the page cache,
+        and new episodes never write back to the file.
+        """
+        with open(path, 'rb') as f:
+            magic = f.read(len(_SNAPSHOT_MAGIC))
+            if magic != _SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} is not a Memory snapshot")
+            version, header_len = struct.unpack('<II', f.read(8))
+            if version not in (1, _SNAPSHOT_VERSION):
+                raise ValueError(f"Unsupported snapshot format version {version}")
+            header = json.loads(f.read(header_len))
+            if header['byteorder'] != sys.byteorder:
+                raise ValueError("Snapshot was written with a different byte order")
+            data_start = _align(len(_SNAPSHOT_MAGIC) + 8 + header_len)
+
+            ep = header['episodes']
+            size = os.fstat(f.fileno()).st_size
+            if any(data_start + off + nbytes > size for _, _, off, nbytes in ep['columns']):
+                raise ValueError(f"{path} is truncated: episode columns extend past the end of the file")
+            if mmap:
+                mapping = mmap_module.mmap(f.fileno(), 0, access=mmap_module.ACCESS_COPY)
+                buf = memoryview(mapping)
+                columns = {
+                    name: buf[data_start + off:data_start + off + nbytes].cast(code)
+                    for name, code, off, nbytes in ep['columns']
+                }
+            else:
+                mapping = None
+                columns = {}
+                for name, code, off, nbytes in ep['columns']:
+                    f.seek(data_start + off)
+                    col = array(code)
+                    col.frombytes(f.read(nbytes))
+                    columns[name] = col
+
+        widths = header['state_hasher']
+        memory = cls(episode_capacity=1, state_hasher=EXACT if widths is None else StateHasher(widths))
+        memory.episodes = EpisodeStore.from_columns(columns, ep['capacity'], ep['size'], ep['head'])
+        memory._episode_index = None
+        memory._mmap = mapping
+        for rule in header['rules']:
+            memory.store_rule(rule)
+        if version == 1:
+            for task_id, seq in header['skills']:
+                memory.store_skill(task_id, seq)
+        else:
+            memory.skills.from_records(header['skills'])
+        return memory
 
     # -------------------------
     # Internals
     # -------------------------
     def _state_hash(self, state):
-        state_str = json.dumps(state, sort_keys=True)
-        return hashlib.md5(state_str.encode()).hexdigest()[:8]
+        # The 'hash' column is int64: exact keys already fit, quantized keys
+        # (up to 126 bits) are folded through hash(), which is below 2**61
+        key = self.state_hasher(State.coerce(state))
+        return key if self.state_hasher.exact else hash(key)
 
     def _canonicalize_rule(self, rule):
         """
@@ -100,6 +259,27 @@ class Memory:
         # ensure stable ordering via json roundtrip
         return json.loads(json.dumps(stripped, sort_keys=True))
 
+    # Bucket widths match the _rules_equal tolerances, so any equal rule lives
+    # in the same or an adjacent bucket.
+    _BUCKET_WIDTH = {'gravity': 0.05, 'friction': 0.01, 'state_transition': 5.0}
+
+    def _rule_bucket(self, canonical, offset=0):
+        t = canonical.get('type')
+        if t in ('gravity', 'friction'):
+            return (t, math.floor(canonical['value'] / self._BUCKET_WIDTH[t]) + offset)
+        if t == 'state_transition':
+            b = math.floor(canonical['threshold'] / self._BUCKET_WIDTH[t]) + offset
+            return (t, canonical['new_state'], b)
+        return ('exact', json.dumps(canonical, sort_keys=True))
+
+    def _find_equal_rule(self, canonical):
+        offsets = (-1, 0, 1) if canonical.get('type') in self._BUCKET_WIDTH else (0,)
+        for offset in offsets:
+            for existing in self._rule_index.get(self._rule_bucket(canonical, offset), ()):
+                if self._rules_equal(canonical, existing):
+                    return existing
+        return None
+
     def _rules_equal(self, a, b):
         """
         Physics-aware tolerance equality.
@@ -1,59 +1,128 @@
+from heapq import heappop, heappush, nsmallest
+from itertools import count
+from time import perf_counter
+
+from state import State
+from skill_library import goal_signature
+from state_hash import PLANNER
+
 class Planner:
     """Goal-directed action planning"""
 
-    def __init__(self, world_model, memory):
+    def __init__(self, world_model, memory, beam_width=100, max_expansions=2000, clock=perf_counter):
         self.world_model = world_model
         self.memory = memory
+        self.clock = clock  # what plan() deadlines are measured against
         self.actions = ["push_right", "push_left", "heat", "cool", "wait"]
-
-    def plan(self, state, goal, max_depth=10):
-        # Stored skill check
+        self.beam_width = beam_width
+        self.max_expansions = max_expansions
+        self.total_expansions = 0  # over every plan() call
+        self.deadline_hits = 0
+
+    def plan(self, state, goal, max_depth=10, deadline=None):
+        """
+        Search for an action sequence reaching `goal`. With a deadline on
+        self.clock (perf_counter by default) the search is anytime: once the
+        deadline passes it returns the plan to the node closest to the goal
+        found so far.
+        """
+        state = State.coerce(state)
+
+        # Stored skill check: the task's best skill, then skills recorded from
+        # this region for this goal
+        skills = self.memory.skills
+        candidates = [list(skill.actions) for skill in skills.lookup(state, goal)]
         if hasattr(goal, "get") and "task_id" in goal:
-            skill = self.memory.get_skill(goal["task_id"])
-            if skill:
-                final_state, conf = self.simulate(state, skill)
-                if self._goal_achieved(final_state, goal) and conf > 0.7:
-                    return skill
-
-        best_plan = None
-        best_score = float("inf")
-
-        frontier = [(state.copy(), [], 0, set())]  # (state, plan, cost, visited_in_path)
-
-        for _ in range(2000):
-            if not frontier:
-                break
-
-            curr_state, plan, cost, path_visited = frontier.pop(0)
-
-            coarsened = self._coarsen_state(curr_state)
-            if coarsened in path_visited:
-                cost += 10
-            else:
-                path_visited = path_visited.copy()
-                path_visited.add(coarsened)
-
+            best = skills.best_for_task(goal["task_id"])
+            if best:
+                candidates.insert(0, best)
+        for skill in candidates:
+            final_state, conf = self.simulate(state, skill)
+            if self._goal_achieved(final_state, goal) and conf > 0.7:
+                return skill
+
+        # Best-first search over a heap of (cost, tiebreak, key, state, depth, plan)
+        # where plan is an (action, parent) cons cell, so extending it is O(1).
+        # best_cost is a transposition table over coarsened states: a node is only
+        # pushed if it reaches its cell more cheaply than anything seen so far.
+        # A node's children come from one predict_batch call over all actions.
+        # Skills recorded from a node's region for this goal are expanded too, as
+        # macro-actions: one child at the end of the whole stored sequence.
+        tiebreak = count()
+        root_key = self._coarsen_state(state)
+        frontier = [(0.0, next(tiebreak), root_key, state, 0, None)]
+        best_cost = {root_key: 0.0}
+        actions = self.actions
+        predict_batch = self.world_model.predict_batch
+        macros = self.memory.skills.macros
+        signature = goal_signature(goal)
+
+        # Anytime bookkeeping: (goal distance, plan) of the closest node popped
+        best = (self._goal_distance(state, goal), None)
+
+        clock = self.clock
+        expansions = 0
+        while frontier and expansions < self.max_expansions:
+            if deadline is not None and clock() >= deadline:
+                self.deadline_hits += 1
+                self.total_expansions += expansions
+                return self._unwind(best[1])
+
+            node = heappop(frontier)
+            cost, _, key, curr_state, depth, plan = node
+            if cost > best_cost[key]:
+                continue  # superseded by a cheaper path to the same cell
+            expansions += 1
+
+            # Costs never decrease along a path, so the first goal popped is optimal
             if self._goal_achieved(curr_state, goal):
-                if cost < best_score:
-                    best_score = cost
-                    best_plan = plan
-                continue
+                self.total_expansions += expansions
+                return self._unwind(plan)
 
-            if len(plan) >= max_depth:
+            if deadline is not None:
+                distance = self._goal_distance(curr_state, goal)
+                if distance < best[0]:
+                    best = (distance, plan)
+
+            if depth >= max_depth:
                 continue
 
-            for action in self.actions:
-                next_state, conf = self.world_model.predict(curr_state, action)
+            preds, confs = predict_batch([curr_state] * len(actions), actions)
+            for action, next_state, conf in zip(actions, preds, confs):
                 new_cost = cost + 1 + (1.0 - conf) * 3
-                frontier.append((next_state, plan + [action], new_cost, path_visited))
-
-            frontier.sort(key=lambda x: x[2])
-            frontier = frontier[:100]
-
-        return best_plan or []
+                next_key = self._coarsen_state(next_state)
+                if best_cost.get(next_key, new_cost + 1) <= new_cost:
+                    continue
+                best_cost[next_key] = new_cost
+                heappush(frontier, (new_cost, next(tiebreak), next_key, next_state, depth + 1, (action, plan)))
+
+            for skill in macros(key, signature):
+                self._push_macro(frontier, best_cost, tiebreak, node, skill.actions)
+
+            # Beam: keep only the cheapest beam_width nodes (a sorted list is a heap)
+            if len(frontier) > 2 * self.beam_width:
+                frontier = nsmallest(self.beam_width, frontier)
+
+        self.total_expansions += expansions
+        return []
+
+    def _push_macro(self, frontier, best_cost, tiebreak, node, macro):
+        # Roll the macro forward with the model, costing each step like a
+        # primitive expansion, and push the node it ends on
+        cost, _, _, state, depth, plan = node
+        predict = self.world_model.predict
+        for action in macro:
+            state, conf = predict(state, action)
+            cost += 1 + (1.0 - conf) * 3
+            plan = (action, plan)
+        key = self._coarsen_state(state)
+        if best_cost.get(key, cost + 1) <= cost:
+            return
+        best_cost[key] = cost
+        heappush(frontier, (cost, next(tiebreak), key, state, depth + len(macro), plan))
 
     def simulate(self, state, action_sequence):
-        curr_state = state.copy()
+        curr_state = State.coerce(state)
         total_confidence = 0.0
 
         for action in action_sequence:
@@ -80,11 +149,27 @@ class Planner:
                     return False
         return True
 
+    def _goal_distance(self, state, goal):
+        # How far outside the goal's tolerance a state is; a wrong discrete
+        # state counts as one unit
+        tol = float(goal.get("_tol", 0.50))
+        distance = 0.0
+        for key, target in goal.items():
+            if key in ("task_id", "get", "_tol"):
+                continue
+            if key == "state":
+                distance += state["state"] != target
+            else:
+                distance += max(0.0, abs(state[key] - target) - tol)
+        return distance
+
+    def _unwind(self, plan):
+        actions = []
+        while plan is not None:
+            action, plan = plan
+            actions.append(action)
+        actions.reverse()
+        return actions
+
     def _coarsen_state(self, state):
-        x = round(state["x"])
-        y = round(state["y"])
-        vx = round(state["vx"] * 2) / 2
-        vy = round(state["vy"] * 2) / 2
-        temp = round(state["temp"] / 10) * 10
-        st = state["state"]
-        return f"{x},{y},{vx},{vy},{temp},{st}"
+        return PLANNER.key(*state)
@@ -0,0 +1,89 @@
+import hashlib
+import inspect
+import json
+import os
+
+from state_hash import REACHABILITY
+
+# The source of _transition and _reachability_search is part of every
+# fingerprint; bump this when code outside them (helpers such as
+# _rebuild_path, the sweep) changes what a search returns.
+ENGINE_VERSION = 1
+
+
+class ReachabilityCache:
+    """
+    On-disk cache of reachability_check results.
+
+    Each result (reachable, witness_path, expanded) is one small JSON file
+    named by a sha256 fingerprint of everything the search depends on: the
+    task spec and goal (including its tolerance), the world's hidden_rules
+    and physics_spec(), the source of its transition and search code, the
+    tolerance used, horizon and expansion budget, the visited-set
+    discretization and ENGINE_VERSION. Changing any of them changes the key,
+    so stale entries are never read. The directory defaults to
+    $MARCOS_CACHE_DIR, else ~/.cache/marcos. PhysicsWorld only creates one
+    when $MARCOS_CACHE_DIR is set; otherwise assign one to
+    world.reachability_cache. Cache I/O is best effort: an unreadable or
+    unwritable cache behaves like an empty one.
+    """
+
+    def __init__(self, directory=None):
+        if directory is None:
+            base = os.environ.get("MARCOS_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "marcos")
+            directory = os.path.join(base, "reachability")
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def fingerprint(self, world, task_id, tol, max_steps, max_expansions):
+        goal = world.get_goal(task_id)
+        spec = {
+            'engine': ENGINE_VERSION,
+            'task': world.get_tasks()[task_id],
+            'goal': goal,
+            'hidden_rules': world.hidden_rules,
+            'physics': world.physics_spec(),
+            'code': [_source(getattr(type(world), name)) for name in ('_transition', '_reachability_search')],
+            'tol': goal.get("_tol", 0.50) if tol is None else tol,
+            'max_steps': max_steps,
+            'max_expansions': max_expansions,
+            'discretization': REACHABILITY.widths,
+        }
+        blob = json.dumps(spec, sort_keys=True, default=repr).encode()
+        return hashlib.sha256(blob).hexdigest()
+
+    def get(self, key):
+        try:
+            with open(self._path(key)) as f:
+                reachable, path, expanded = json.load(f)
+            result = bool(reachable), [str(a) for a in path], int(expanded)
+        except (OSError, ValueError, TypeError):
+            # Unreadable, not JSON, or JSON of the wrong shape
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        reachable, path, expanded = result
+        target = self._path(key)
+        tmp = f"{target}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp, "w") as f:
+                json.dump([reachable, list(path), expanded], f)
+            os.replace(tmp, target)  # atomic: readers never see a partial file
+        except OSError:
+            pass
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+
+def _source(func):
+    # Falls back to the bytecode when the source isn't available (frozen, REPL)
+    try:
+        return inspect.getsource(func)
+    except (OSError, TypeError):
+        return func.__code__.co_code.hex()
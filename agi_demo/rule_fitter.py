@@ -0,0 +1,121 @@
+from world import ACTION_EFFECTS
+
+
+class RuleFitter:
+    """
+    Closed-form rule estimates from observed transitions.
+
+    The library's dynamics are (after the known action effects)
+        vx' = f * vx
+        vy' = f * (vy - g) = f * vy - f * g
+    so friction f and gravity g fall out of least squares over the velocity
+    updates in one pass. Temperature thresholds are found with a sorted sweep
+    over the observed state flips.
+    """
+
+    def __init__(self, min_samples=1):
+        self.min_samples = min_samples
+
+    def fit(self, window):
+        """Fitted hypotheses (gravity, friction, state transitions) for an EpisodeWindow"""
+        states = list(window.states())
+        actions = list(window.actions())
+        next_states = list(window.next_states())
+        if len(states) < self.min_samples:
+            return []
+
+        hypotheses = []
+        friction, gravity = self.fit_velocity(states, actions, next_states)
+        if gravity is not None:
+            hypotheses.append({'type': 'gravity', 'value': gravity, 'source': 'fit'})
+        if friction is not None:
+            hypotheses.append({'type': 'friction', 'value': friction, 'source': 'fit'})
+        for new_state, threshold in self.fit_thresholds(states, actions, next_states):
+            hypotheses.append({
+                'type': 'state_transition',
+                'threshold': threshold,
+                'new_state': new_state,
+                'source': 'fit',
+            })
+        return hypotheses
+
+    def fit_velocity(self, states, actions, next_states, eps=1e-9):
+        """Least-squares (friction, gravity); either is None if unidentifiable"""
+        n = 0
+        suu = suv = 0.0                  # vx' = f * u, u = vx + dvx
+        sy = syy = syn = sn = 0.0        # vy' = a * vy + b
+
+        for s, a, ns in zip(states, actions, next_states):
+            u = s[2] + ACTION_EFFECTS[a][0]
+            suu += u * u
+            suv += u * ns[2]
+            vy, vyn = s[3], ns[3]
+            sy += vy
+            syy += vy * vy
+            syn += vy * vyn
+            sn += vyn
+            n += 1
+
+        friction = suv / suu if suu > eps else None
+
+        var_y = syy - sy * sy / n
+        if var_y > eps:
+            a = (syn - sy * sn / n) / var_y
+            b = (sn - a * sy) / n
+            if friction is None:
+                friction = a
+        elif friction is not None:
+            # vy never varied: only the intercept is identifiable, using f from vx
+            b = (sn - friction * sy) / n
+        else:
+            return None, None
+
+        if friction is None or abs(friction) < eps:
+            return friction, None
+        return friction, -b / friction
+
+    def fit_thresholds(self, states, actions, next_states):
+        """
+        For each state the world flipped up into, the temperature threshold that
+        best separates flips from non-flips under `temp > threshold`. Returns
+        [(new_state, threshold)].
+        """
+        targets = sorted({ns[5] for s, ns in zip(states, next_states) if ns[5] > s[5]})
+        fits = []
+        for target in targets:
+            samples = sorted(
+                (s[4] + ACTION_EFFECTS[a][1], ns[5] == target)
+                for s, a, ns in zip(states, actions, next_states)
+                if s[5] < target
+            )
+            threshold = _sweep_threshold(samples)
+            if threshold is not None:
+                fits.append((target, threshold))
+        return fits
+
+
+def _sweep_threshold(samples):
+    """
+    samples: (temp, flipped) sorted by temp. Returns the threshold minimizing
+    misclassifications of `flipped == (temp > threshold)`, placed midway
+    between the neighbouring observed temperatures.
+    """
+    if not any(flipped for _, flipped in samples):
+        return None
+
+    errors = sum(1 for _, flipped in samples if not flipped)  # threshold below everything
+    best_errors = errors
+    best = samples[0][0] - 1.0
+
+    i = 0
+    while i < len(samples):
+        temp = samples[i][0]
+        # Move every sample at this temperature to the "not above" side
+        while i < len(samples) and samples[i][0] == temp:
+            errors += 1 if samples[i][1] else -1
+            i += 1
+        if errors < best_errors:
+            best_errors = errors
+            best = temp if i == len(samples) else (temp + samples[i][0]) / 2.0
+
+    return best
@@ -0,0 +1,124 @@
+from collections import namedtuple
+
+from state import State
+from state_hash import PLANNER
+
+# goal: goal_signature() of the goal it reached (None for task-only skills);
+# start: the State it was taken from (None for task-only skills)
+Skill = namedtuple("Skill", "task_id start goal actions")
+
+
+def goal_signature(goal):
+    """Hashable identity of a goal: its targets, without task_id/_tol metadata"""
+    return tuple(sorted((k, v) for k, v in goal.items() if k not in ("task_id", "_tol", "get")))
+
+
+class SkillLibrary:
+    """
+    Successful trajectories indexed by (start-state region, goal signature).
+
+    A region is the planner's coarse state cell (state_hash.PLANNER by
+    default), so search nodes can look skills up by the key they already
+    carry. Recording a trajectory files every suffix under the region of the
+    state it starts from, keeping the `per_key` shortest sequences per key.
+    The shortest full trajectory per task_id is kept separately for
+    task-level lookups.
+    """
+
+    def __init__(self, state_hasher=PLANNER, per_key=3):
+        self.state_hasher = state_hasher
+        self.per_key = per_key
+        self._index = {}    # (region, goal signature) -> [Skill], shortest first
+        self._by_task = {}  # task_id -> shortest Skill
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self._index.values())
+
+    def region(self, state):
+        return self.state_hasher(State.coerce(state))
+
+    def add(self, task_id, actions, start=None, goal=None):
+        """
+        Record one skill. With a start state and goal it is also indexed.
+        Returns True if it became the task's best or entered the index.
+        """
+        actions = tuple(actions)
+        if start is not None:
+            start = State.coerce(start)
+        signature = None if goal is None else goal_signature(goal)
+        skill = Skill(task_id, start, signature, actions)
+
+        added = self._offer_task(skill)
+        if start is not None and signature is not None and actions:
+            added = self._file(skill) or added
+        return added
+
+    def add_trajectory(self, task_id, states, actions, goal):
+        """
+        Record a successful trajectory: actions[i] was taken in states[i]. Each
+        suffix is indexed as a skill from its own start state.
+        """
+        actions = list(actions)
+        if len(states) != len(actions):
+            raise ValueError("need one start state per action")
+        added = self.add(task_id, actions, states[0], goal) if actions else False
+        signature = goal_signature(goal)
+        for i in range(1, len(actions)):
+            added = self._file(Skill(task_id, State.coerce(states[i]), signature, tuple(actions[i:]))) or added
+        return added
+
+    def best_for_task(self, task_id):
+        """Shortest recorded action sequence for a task, as a list, or None"""
+        skill = self._by_task.get(task_id)
+        return None if skill is None else list(skill.actions)
+
+    def lookup(self, state, goal):
+        """Skills starting in `state`'s region that reached `goal`, shortest first"""
+        return self.macros(self.region(state), goal_signature(goal))
+
+    def macros(self, region, signature):
+        """lookup() by precomputed region key and goal signature"""
+        return self._index.get((region, signature), ())
+
+    def to_records(self):
+        """JSON-serializable form, see from_records"""
+        def record(skill):
+            return [
+                skill.task_id,
+                list(skill.actions),
+                None if skill.start is None else list(skill.start),
+                None if skill.goal is None else [list(pair) for pair in skill.goal],
+            ]
+
+        return {
+            'tasks': [record(s) for s in self._by_task.values()],
+            'index': [record(s) for bucket in self._index.values() for s in bucket],
+        }
+
+    def from_records(self, records):
+        """Add skills from to_records() output"""
+        for task_id, actions, start, goal in records['tasks']:
+            self._offer_task(Skill(
+                task_id,
+                None if start is None else State(*start),
+                None if goal is None else goal_signature(dict(goal)),
+                tuple(actions),
+            ))
+        for task_id, actions, start, goal in records['index']:
+            self._file(Skill(task_id, State(*start), goal_signature(dict(goal)), tuple(actions)))
+
+    def _offer_task(self, skill):
+        best = self._by_task.get(skill.task_id)
+        if best is not None and len(best.actions) <= len(skill.actions):
+            return False
+        self._by_task[skill.task_id] = skill
+        return True
+
+    def _file(self, skill):
+        bucket = self._index.setdefault((self.region(skill.start), skill.goal), [])
+        if any(s.actions == skill.actions for s in bucket):
+            return False
+        bucket.append(skill)
+        bucket.sort(key=lambda s: len(s.actions))
+        del bucket[self.per_key:]
+        return skill in bucket
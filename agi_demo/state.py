@@ -0,0 +1,84 @@
+from collections import namedtuple
+
+FIELDS = ("x", "y", "vx", "vy", "temp", "state")
+FIELD_INDEX = {k: i for i, k in enumerate(FIELDS)}
+
+# namedtuple base gives C-level field accessors that don't go through __getitem__
+_StateTuple = namedtuple("_StateTuple", FIELDS)
+
+
+class State(_StateTuple):
+    """
+    Immutable world state packed as (x, y, vx, vy, temp, state).
+
+    Shared freely between modules (never needs copying) and read-compatible with
+    the old 6-key dict states: s["x"], s.get("x"), keys()/items(), dict(s) and
+    equality against dicts all behave like the dict did.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, d):
+        return tuple.__new__(cls, (d["x"], d["y"], d["vx"], d["vy"], d["temp"], d["state"]))
+
+    @classmethod
+    def coerce(cls, obj):
+        """Return obj as a State (no-op for States, adapter for dict states)"""
+        if obj.__class__ is cls:
+            return obj
+        if isinstance(obj, cls):
+            return tuple.__new__(cls, obj)
+        return cls.from_dict(obj)
+
+    def to_dict(self):
+        return dict(zip(FIELDS, self))
+
+    def replace(self, **changes):
+        values = list(self)
+        for k, v in changes.items():
+            values[FIELD_INDEX[k]] = v
+        return tuple.__new__(State, values)
+
+    # -------------------------
+    # Dict adapter
+    # -------------------------
+    def __getitem__(self, key):
+        if key.__class__ is str:
+            return tuple.__getitem__(self, FIELD_INDEX[key])
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        i = FIELD_INDEX.get(key)
+        if i is None:
+            return default
+        return tuple.__getitem__(self, i)
+
+    def __contains__(self, key):
+        return key in FIELD_INDEX
+
+    def keys(self):
+        return FIELDS
+
+    def values(self):
+        return tuple(self)
+
+    def items(self):
+        return zip(FIELDS, self)
+
+    def copy(self):
+        # Immutable: sharing is safe, so "copying" is free
+        return self
+
+    def __eq__(self, other):
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return tuple.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = tuple.__hash__
+
+    def __repr__(self):
+        return "State(" + ", ".join(f"{k}={v!r}" for k, v in zip(FIELDS, self)) + ")"
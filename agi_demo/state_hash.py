@@ -0,0 +1,60 @@
+_OFFSET = 1 << 20
+_BITS = 21
+
+
+class StateHasher:
+    """
+    Cheap integer keys for (x, y, vx, vy, temp, state) states.
+
+    exact mode (widths=None): Python's tuple hash of the raw field values.
+    quantized mode: each field is rounded to a multiple of its bucket width and
+    the bucket indices are packed into one int of up to 126 bits (21-bit
+    offset fields). States in the same buckets always share a key; states in
+    different buckets get different keys as long as every bucket index is
+    within +-2**20, beyond that (temp is unbounded) an index spills into the
+    neighbouring field and keys can collide.
+    """
+
+    def __init__(self, widths=None):
+        self.widths = None if widths is None else tuple(float(w) for w in widths)
+        if self.widths is not None and len(self.widths) != 6:
+            raise ValueError("widths must give one bucket width per state field")
+        self.key = _exact_key if self.widths is None else _make_packer(self.widths)
+
+    @property
+    def exact(self):
+        return self.widths is None
+
+    def __call__(self, state):
+        return self.key(*state)
+
+    def __repr__(self):
+        return f"StateHasher(widths={self.widths})"
+
+
+def _exact_key(x, y, vx, vy, temp, st):
+    return hash((x, y, vx, vy, temp, st))
+
+
+def _make_packer(widths):
+    wx, wy, wvx, wvy, wt, ws = widths
+
+    def key(x, y, vx, vy, temp, st):
+        return (
+            ((round(x / wx) + _OFFSET) << (5 * _BITS))
+            | ((round(y / wy) + _OFFSET) << (4 * _BITS))
+            | ((round(vx / wvx) + _OFFSET) << (3 * _BITS))
+            | ((round(vy / wvy) + _OFFSET) << (2 * _BITS))
+            | ((round(temp / wt) + _OFFSET) << _BITS)
+            | (round(st / ws) + _OFFSET)
+        )
+
+    return key
+
+
+# Shared key functions
+EXACT = StateHasher()
+# PhysicsWorld.reachability_check visited set
+REACHABILITY = StateHasher((0.5, 0.5, 0.5, 0.5, 5.0, 1.0))
+# Planner transposition table
+PLANNER = StateHasher((1.0, 1.0, 0.5, 0.5, 10.0, 1.0))
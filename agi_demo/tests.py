@@ -1,8 +1,26 @@
 #!/usr/bin/env python3
+import json
+import os
+import random
+import tempfile
+import time
 import unittest
 
-from world import PhysicsWorld
+from world import PhysicsWorld, ACTIONS
 from agent import Agent
+from compute_controller import ComputeController
+import bench
+from episode_index import EpisodeIndex
+from episode_store import EpisodeStore
+from instrumentation import Instrumentation
+from memory import Memory
+from planner import Planner
+from reachability_cache import ReachabilityCache
+from skill_library import SkillLibrary
+from state import State
+from state_hash import EXACT, PLANNER, REACHABILITY, StateHasher
+from trainer import Trainer, run_episode
+from vec_world import VecPhysicsWorld
 
 
 class TestAGIDemo(unittest.TestCase):
@@ -21,6 +39,113 @@ class TestAGIDemo(unittest.TestCase):
         s2 = w.step(s.copy(), "wait")
         self.assertLess(s2["y"], s["y"])
 
+    def test_step_batch_matches_step(self):
+        w = PhysicsWorld()
+        rows = [
+            w.reset(1),
+            w.reset(2),
+            {"x": 9.8, "y": 0.1, "vx": 3.0, "vy": -2.0, "temp": 45.0, "state": 0},
+            {"x": -9.5, "y": 19.9, "vx": -4.0, "vy": 5.0, "temp": 60.0, "state": 1},
+            {"x": 0.0, "y": 5.0, "vx": 0.0, "vy": 0.0, "temp": 25.0, "state": 2},
+        ]
+        states = {k: [] for k in ("x", "y", "vx", "vy", "temp", "state")}
+        actions = []
+        expected = []
+        for row in rows:
+            for i, a in enumerate(ACTIONS):
+                for k in states:
+                    states[k].append(row[k])
+                actions.append(i)
+                expected.append(w.step(row.copy(), a))
+
+        out = w.step_batch(states, actions)
+        for i, exp in enumerate(expected):
+            got = {k: out[k][i] for k in out}
+            self.assertEqual(got, exp)
+
+        # A float state column (NumPy's default dtype) steps the same
+        float_states = dict(states, state=[float(st) for st in states["state"]])
+        self.assertEqual(w.step_batch(float_states, actions), out)
+
+        with self.assertRaises(ValueError):
+            w.step_batch({k: v[:1] for k, v in states.items()}, [7])
+
+    def test_vec_world_lanes_match_single_episodes(self):
+        w = PhysicsWorld()
+        vec = VecPhysicsWorld(4, task_ids=[1, 2], world=w, max_steps=5)
+        heat = ACTIONS.index("heat")
+        rng = random.Random(0)
+
+        # Lanes 0/2 run task 1 on random actions; lanes 1/3 heat task 2 to its goal
+        singles = [w.initial_state(t) for t in vec.task_ids]
+        for _ in range(5):
+            actions = [rng.randrange(len(ACTIONS)), heat, rng.randrange(len(ACTIONS)), heat]
+            expected = [w.step(s, ACTIONS[a]) for s, a in zip(singles, actions)]
+            next_cols, achieved, done = vec.step(actions)
+            for i, exp in enumerate(expected):
+                self.assertEqual(State(*(next_cols[k][i] for k in exp.keys())), exp)
+                self.assertEqual(bool(achieved[i]), w.goal_achieved(exp, vec.task_ids[i]))
+            singles = [
+                w.initial_state(vec.task_ids[i]) if done[i] else exp for i, exp in enumerate(expected)
+            ]
+            self.assertEqual(vec.states(), singles)
+
+        # Task 2 is three heats away; task 1 lanes time out at max_steps
+        self.assertEqual(vec.episodes_succeeded, 2)
+        self.assertGreaterEqual(vec.episodes_finished, 4)
+
+    def test_state_dict_adapter(self):
+        w = PhysicsWorld()
+        d = w.reset(1)
+        s = State.from_dict(d)
+
+        self.assertEqual(s, d)
+        self.assertEqual(dict(s), d)
+        self.assertEqual(s["temp"], d["temp"])
+        self.assertEqual(s.get("missing", 1), 1)
+        self.assertIs(s.copy(), s)
+        with self.assertRaises(AttributeError):
+            s.x = 1.0
+
+        # State in -> State out, same values as the legacy dict path
+        for a in ACTIONS:
+            ns = w.step(s, a)
+            self.assertIsInstance(ns, State)
+            self.assertEqual(ns, w.step(d.copy(), a))
+
+    def test_state_hasher_modes(self):
+        a = State(1.2, 3.0, 0.6, -0.2, 26.0, 0)
+        b = State(1.1, 3.1, 0.4, -0.1, 24.0, 0)
+
+        # Quantized: same buckets -> same key; the discrete state always separates
+        self.assertEqual(REACHABILITY(a), REACHABILITY(b))
+        self.assertNotEqual(REACHABILITY(a), REACHABILITY(a.replace(state=1)))
+        self.assertNotEqual(REACHABILITY(a), REACHABILITY(a.replace(temp=28.0)))
+
+        coarse = StateHasher((5.0, 5.0, 5.0, 5.0, 50.0, 1.0))
+        self.assertEqual(coarse(a), coarse(a.replace(x=-1.0, vx=-2.0)))
+        self.assertNotEqual(coarse(a), coarse(a.replace(x=-3.0)))
+
+        # Exact: only identical states share a key
+        self.assertEqual(EXACT(a), EXACT(State(*a)))
+        self.assertNotEqual(EXACT(a), EXACT(b))
+        self.assertTrue(EXACT.exact)
+        with self.assertRaises(ValueError):
+            StateHasher((1.0, 1.0))
+
+    def test_memory_accepts_quantized_hashers(self):
+        w = PhysicsWorld()
+        s = w.initial_state(1)
+        for hasher in (REACHABILITY, PLANNER):
+            self.assertGreater(hasher(s).bit_length(), 64)
+            mem = Memory(episode_capacity=4, state_hasher=hasher)
+            mem.store_episode(s, "wait", w.step(s, "wait"), True)
+            mem.store_episode(s.replace(x=0.01), "wait", w.step(s, "wait"), True)
+            first, second = mem.episodes
+            # Folded into the int64 column; same buckets still share a value
+            self.assertEqual(first["hash"], hash(hasher(s)))
+            self.assertEqual(first["hash"], second["hash"])
+
     def test_agent_learns_some_rule(self):
         w = PhysicsWorld()
         agent = Agent()
@@ -35,6 +160,591 @@ class TestAGIDemo(unittest.TestCase):
         stats = agent.get_stats()
         self.assertGreater(stats["memory_episodes"], 0)
 
+    def test_async_learning_matches_sync_after_flush(self):
+        w = PhysicsWorld()
+        rng = random.Random(3)
+        actions = [rng.choice(ACTIONS) for _ in range(40)]
+
+        def run(agent):
+            s = w.initial_state(1)
+            for a in actions:
+                s2 = w.step(s, a)
+                agent.learn_from_experience(s, a, s2, w)
+                agent.flush_learning()
+                s = s2
+            return agent.memory.rule_snapshot()
+
+        sync_version, sync_rules = run(Agent())
+        agent = Agent(async_learning=True)
+        try:
+            async_version, async_rules = run(agent)
+        finally:
+            agent.close()
+
+        self.assertGreater(sync_version, 0)
+        self.assertEqual(async_version, sync_version)
+        self.assertEqual([dict(r) for r in async_rules], [dict(r) for r in sync_rules])
+        # The snapshot handed to the worker is detached from the live ring
+        snap = agent.memory.episode_snapshot(8)
+        agent.memory.store_episode(w.initial_state(2), "wait", w.initial_state(2), True)
+        self.assertEqual(list(snap.last(8).states()), list(agent.memory.episodes.last(9).states())[:8])
+
+    def test_trainer_merges_worker_rules(self):
+        def train(processes):
+            trainer = Trainer(num_workers=2, task_mix=[(1,), (2,)], sync_every=1, processes=processes)
+            return trainer, trainer.train(episodes_per_worker=2)
+
+        trainer, merged = train(processes=1)
+        self.assertEqual(len(trainer.reports), 2)
+        # Pooled skills go back to every worker: worker 0 only trains task 1
+        # but ends up with the task 2 skill worker 1 found in round one
+        report0 = next(r for r in trainer.reports if r['worker_id'] == 0)
+        self.assertIn(2, [task_id for task_id, *_ in report0['skills']['tasks']])
+        self.assertGreater(len(merged.rules), 0)
+        for report in trainer.reports:
+            for rule in report['rules']:
+                self.assertTrue(merged.contains_rule(rule))
+        # No two merged rules are semantic duplicates
+        keys = [tuple(sorted(merged._canonicalize_rule(dict(r)).items())) for r in merged.rules]
+        self.assertEqual(len(keys), len(set(keys)))
+
+        # Worker processes give the same merge as running in-process
+        trainer_mp, merged_mp = train(processes=2)
+        self.assertEqual(
+            sorted(trainer_mp.reports, key=lambda r: r['worker_id']),
+            sorted(trainer.reports, key=lambda r: r['worker_id']),
+        )
+        self.assertEqual([dict(r) for r in merged_mp.rules], [dict(r) for r in merged.rules])
+        self.assertEqual(merged_mp.skills.to_records(), merged.skills.to_records())
+
+    def test_instrumentation_reports_phases_and_counters(self):
+        w = PhysicsWorld()
+        self.assertNotIn("instrumentation", Agent().get_stats())
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "trace.json")
+            agent = Agent(verbose=False, instrumentation=Instrumentation(True, path, "chrome"))
+            agent.instrumentation.instrument_world(w)
+            for _ in range(2):
+                run_episode(agent, w, 2, max_steps=10)
+            stats = agent.get_stats()["instrumentation"]
+            agent.close()
+
+            with open(path) as f:
+                events = json.load(f)
+
+            # Phases after close() are timed but leave the finished trace alone
+            with agent.instrumentation.phase("plan"):
+                pass
+            plan_calls = agent.instrumentation.stats()["phases"]["plan"]["calls"]
+            self.assertEqual(plan_calls, stats["phases"]["plan"]["calls"] + 1)
+            with open(path) as f:
+                self.assertEqual(json.load(f), events)
+
+        counters, phases = stats["counters"], stats["phases"]
+        steps = counters["world.step"]
+        self.assertGreater(steps, 0)
+        self.assertEqual(phases["act"]["calls"], steps)
+        self.assertEqual(phases["learn"]["calls"], steps)
+        self.assertGreater(counters["plan.expansions"], 0)
+        self.assertGreater(counters["predict.calls"], 0)
+        # Uncached predictions (audits, hypothesis baselines) count as calls too
+        self.assertGreaterEqual(
+            counters["predict.calls"], counters["predict.cache_hits"] + counters["predict.cache_misses"]
+        )
+        calls = agent.world_model.predictions
+        agent.world_model.predict(w.initial_state(1), "wait", use_cache=False)
+        self.assertEqual(agent.world_model.predictions, calls + 1)
+        self.assertEqual(sum(phases["plan"]["histogram_us"].values()), phases["plan"]["calls"])
+        self.assertEqual(len(events), sum(p["calls"] for p in phases.values()))
+        self.assertEqual({e["ph"] for e in events}, {"X"})
+
+    def test_planner_plans_with_known_rules(self):
+        w = PhysicsWorld()
+        agent = Agent()
+        for rule in (
+            {"type": "gravity", "value": 0.3},
+            {"type": "friction", "value": 0.95},
+            {"type": "state_transition", "threshold": 50.0, "new_state": 2},
+        ):
+            agent.memory.store_rule(rule)
+
+        s = w.initial_state(2)
+        goal = w.get_goal(2)
+        plan = agent.planner.plan(s, goal, max_depth=5)
+        self.assertGreater(len(plan), 0)
+        final, _ = agent.planner.simulate(s, plan)
+        self.assertEqual(final["state"], 2)
+
+        # Already at the goal -> empty plan
+        self.assertEqual(agent.planner.plan(final, goal, max_depth=5), [])
+
+    def test_planner_solves_task1_with_known_rules(self):
+        w = PhysicsWorld()
+        agent = Agent(verbose=False)
+        for rule in (
+            {"type": "gravity", "value": 0.3},
+            {"type": "friction", "value": 0.95},
+            {"type": "state_transition", "threshold": 50.0, "new_state": 1},
+            {"type": "state_transition", "threshold": 50.0, "new_state": 2},
+        ):
+            agent.memory.store_rule(rule)
+
+        s = w.reset(1)
+        for depth in (10, 15):
+            plan = agent.planner.plan(s, w.get_goal(1), max_depth=depth)
+            self.assertGreater(len(plan), 0)
+            final = s
+            for action in plan:
+                final = w.step(final, action)
+            self.assertTrue(w.goal_achieved(final, 1))
+
+    def test_deadline_planning_is_anytime(self):
+        w = PhysicsWorld()
+        agent = Agent()
+        for rule in (
+            {"type": "gravity", "value": 0.3},
+            {"type": "friction", "value": 0.95},
+        ):
+            agent.memory.store_rule(rule)
+        planner = agent.planner
+        s, goal = w.initial_state(1), w.get_goal(1)
+
+        # A generous deadline changes nothing
+        full = planner.plan(s, goal, max_depth=15)
+        self.assertEqual(planner.plan(s, goal, max_depth=15, deadline=time.perf_counter() + 60), full)
+
+        # An expired deadline stops before the next expansion with the best partial plan
+        hits = planner.deadline_hits
+        partial = planner.plan(s, goal, max_depth=15, deadline=time.perf_counter())
+        self.assertEqual(planner.deadline_hits, hits + 1)
+        self.assertEqual(partial, [])  # nothing popped yet: the root is the best node
+
+        # A clock that expires after two expansions: the root, then its best child
+        clocked = Planner(agent.world_model, agent.memory, clock=iter([0.0, 0.0, 2.0]).__next__)
+        partial = clocked.plan(s, goal, max_depth=15, deadline=1.0)
+        self.assertEqual(clocked.deadline_hits, 1)
+        self.assertEqual(len(partial), 1)
+        end, _ = planner.simulate(s, partial)
+        self.assertLess(planner._goal_distance(end, goal), planner._goal_distance(s, goal))
+
+        # Budget mode: the controller's deadline tracks observed overruns
+        controller = ComputeController(latency_budget=0.01)
+        controller.thinking_level = 2
+        self.assertAlmostEqual(controller.plan_budget(), 0.005)
+        controller.record_plan_time(0.007, 0.005)
+        self.assertAlmostEqual(controller.plan_budget(), 0.005 - 0.2 * 0.002)
+        self.assertIsNone(ComputeController().plan_budget())
+
+    def test_act_reuses_plan_tail_until_it_stops_applying(self):
+        w = PhysicsWorld()
+        agent = Agent()
+        for rule in (
+            {"type": "gravity", "value": 0.3},
+            {"type": "friction", "value": 0.95},
+        ):
+            agent.memory.store_rule(rule)
+        s, goal = w.initial_state(1), w.get_goal(1)
+
+        action, _ = agent.act(s, goal, w)
+        tail = list(agent._plan_tail)
+        self.assertGreater(len(tail), 0)
+
+        # On track: the next act() takes the tail's head without searching
+        expansions = agent.planner.total_expansions
+        s = w.step(s, action)
+        action, _ = agent.act(s, goal, w)
+        self.assertEqual(action, tail[0])
+        self.assertEqual(agent.plans_reused, 1)
+        self.assertEqual(agent.planner.total_expansions, expansions)
+
+        # Off track (the state isn't where the model predicted) -> replan
+        agent.act(s.replace(x=s.x - 3.0), goal, w)
+        self.assertEqual(agent.plans_reused, 1)
+
+        # A different goal -> replan
+        s = w.step(s, action)
+        agent.act(s, w.get_goal(2), w)
+        self.assertEqual(agent.plans_reused, 1)
+
+    def test_skills_expand_as_macros_in_search(self):
+        w = PhysicsWorld()
+        agent = Agent()
+        for rule in (
+            {"type": "gravity", "value": 0.3},
+            {"type": "friction", "value": 0.95},
+        ):
+            agent.memory.store_rule(rule)
+        planner = agent.planner
+        s0, goal = w.initial_state(1), w.get_goal(1)
+
+        plan = planner.plan(s0, goal, max_depth=15)
+        cold = planner.total_expansions
+        states = [s0]
+        for a in plan[:-1]:
+            states.append(w.step(states[-1], a))
+
+        # Record the trajectory minus its first step: from s0 the stored skill
+        # alone misses the goal, but one primitive step reaches its region
+        agent.memory.store_skill(1, plan[1:], states[1:], goal)
+        library = agent.memory.skills
+        self.assertEqual(len(library), len(plan) - 1)  # one entry per suffix
+        self.assertEqual([list(sk.actions) for sk in library.lookup(states[2], goal)], [plan[2:]])
+
+        before = planner.total_expansions
+        macro_plan = planner.plan(s0, goal, max_depth=2)
+        self.assertEqual(len(macro_plan), len(plan))
+        final, _ = planner.simulate(s0, macro_plan)
+        self.assertTrue(planner._goal_achieved(final, goal))
+        self.assertLess(planner.total_expansions - before, cold)
+
+        copy = SkillLibrary()
+        copy.from_records(json.loads(json.dumps(library.to_records())))
+        self.assertEqual(copy.to_records(), library.to_records())
+        self.assertEqual(copy.best_for_task(1), plan[1:])
+
+    def test_predict_batch_matches_predict(self):
+        w = PhysicsWorld()
+        agent = Agent()
+        for rule in (
+            {"type": "gravity", "value": 0.3},
+            {"type": "friction", "value": 0.95},
+            {"type": "state_transition", "threshold": 50.0, "new_state": 1},
+        ):
+            agent.memory.store_rule(rule)
+        wm = agent.world_model
+
+        # Temperatures on both sides of the threshold, so heat/cool/wait cross it
+        states = [
+            w.initial_state(1),
+            w.initial_state(2),
+            State(1.0, 4.0, 0.5, -1.0, 40.0, 0),
+            State(-2.0, 6.0, -0.5, 0.2, 49.5, 0),
+            State(3.0, 2.0, 1.5, 0.0, 60.0, 1),
+        ]
+        rows = [(s, a) for s in states for a in ACTIONS]
+        # Fresh batch (cache misses), then the same rows again (cache hits);
+        # both must match the uncached model
+        for _ in range(2):
+            preds, confs = wm.predict_batch([r[0] for r in rows], [r[1] for r in rows])
+            self.assertEqual(len(preds), len(rows))
+            for (s, a), pred, conf in zip(rows, preds, confs):
+                self.assertEqual((pred, conf), wm.predict(s, a, use_cache=False))
+        self.assertEqual(wm.cache_hits, len(rows))
+        self.assertEqual({p.state for p in preds}, {0, 1})
+
+    def test_prediction_cache_survives_updates_until_rules_change(self):
+        w = PhysicsWorld()
+        agent = Agent()
+        agent.world_model.cache_size = 4
+        wm = agent.world_model
+        s = w.initial_state(1)
+
+        wm.predict(s, "wait")
+        wm.update_from_experience(s, "wait", w.step(s, "wait"))
+        wm.predict(s, "wait")
+        self.assertEqual(wm.cache_stats()["misses"], 1)
+        self.assertEqual(wm.cache_stats()["hits"], 2)
+
+        # A new rule changes the version, so the old entry is no longer used
+        agent.memory.store_rule({"type": "gravity", "value": 0.3})
+        pred, _ = wm.predict(s, "wait")
+        self.assertEqual(wm.cache_stats()["misses"], 2)
+        self.assertAlmostEqual(pred["vy"], -0.3)
+
+        for a in ACTIONS:
+            wm.predict(s, a)
+        self.assertEqual(wm.cache_stats()["size"], 4)
+        self.assertGreater(wm.cache_stats()["evictions"], 0)
+
+    def test_prediction_cache_keys_use_the_compiled_version(self):
+        # A rule accepted by the learning thread right after the model took its
+        # rule snapshot: predictions made from the old rules must be cached
+        # under the old version, not served once the new version is current
+        w = PhysicsWorld()
+        s = w.initial_state(1)
+        for batch in (False, True):
+            agent = Agent()
+            wm, memory = agent.world_model, agent.memory
+            take_snapshot = memory.rule_snapshot
+
+            def racing_snapshot():
+                snapshot = take_snapshot()
+                memory.store_rule({"type": "gravity", "value": 0.3})
+                return snapshot
+
+            def predict():
+                if batch:
+                    return wm.predict_batch([s], ["wait"])[0][0]
+                return wm.predict(s, "wait")[0]
+
+            memory.rule_snapshot = racing_snapshot
+            try:
+                stale = predict()
+            finally:
+                memory.rule_snapshot = take_snapshot
+            self.assertAlmostEqual(stale["vy"], 0.0)
+            self.assertEqual({key[2] for key in wm.prediction_cache}, {0})
+            self.assertAlmostEqual(predict()["vy"], -0.3)
+
+    def test_compiled_dynamics_match_world(self):
+        w = PhysicsWorld()
+        agent = Agent()
+        for rule in (
+            {"type": "gravity", "value": 0.3},
+            {"type": "friction", "value": 0.95},
+            {"type": "state_transition", "threshold": 50.0, "new_state": 1},
+        ):
+            agent.memory.store_rule(rule)
+
+        s = w.initial_state(2)
+        for a in ("push_left", "heat", "heat", "cool"):
+            pred, _ = agent.world_model.predict(s, a)
+            actual = w.step(s, a)
+            for key in ("x", "y", "vx", "vy", "temp", "state"):
+                self.assertAlmostEqual(pred[key], actual[key], places=9)
+            s = actual
+
+        # Running confidence agrees with a from-scratch average
+        wm = agent.world_model
+        for _ in range(60):
+            wm.update_from_experience(s, "wait", w.step(s, "cool"))
+        avg = sum(wm.recent_errors) / len(wm.recent_errors)
+        self.assertAlmostEqual(wm.get_prediction_error(), avg)
+        self.assertAlmostEqual(wm.predict(s, "wait")[1], max(0.05, min(0.95, 1.0 / (1.0 + avg))))
+
+    def test_rule_snapshots_are_versioned_and_deduped(self):
+        mem = Agent().memory
+        self.assertTrue(mem.store_rule({"type": "gravity", "value": 0.3, "source": "test"}))
+        version, snapshot = mem.rule_snapshot()
+
+        # Semantic duplicates (within tolerance, across bucket edges) are rejected
+        self.assertFalse(mem.store_rule({"type": "gravity", "value": 0.26}))
+        self.assertFalse(mem.store_rule({"type": "gravity", "value": 0.349}))
+        self.assertEqual(mem.rule_version, version)
+        self.assertIs(mem.get_rules(), snapshot)
+
+        self.assertTrue(mem.store_rule({"type": "gravity", "value": 0.36}))
+        self.assertTrue(mem.store_rule({"type": "state_transition", "threshold": 50.0, "new_state": 1}))
+        self.assertFalse(mem.store_rule({"type": "state_transition", "threshold": 46.0, "new_state": 1}))
+        self.assertTrue(mem.store_rule({"type": "state_transition", "threshold": 50.0, "new_state": 2}))
+        self.assertTrue(mem.contains_rule({"type": "gravity", "value": 0.31}))
+
+        # Held snapshots never change; new rules produce a new snapshot
+        self.assertEqual(len(snapshot), 1)
+        self.assertEqual(len(mem.get_rules()), 4)
+        self.assertEqual(mem.rule_version, version + 3)
+        with self.assertRaises(TypeError):
+            mem.get_rules()[0]["value"] = 1.0
+
+    def test_episode_store_ring_buffer(self):
+        w = PhysicsWorld()
+        store = EpisodeStore(capacity=4)
+        s = w.initial_state(1)
+        rows = []
+        for i in range(6):
+            a = ACTIONS[i % len(ACTIONS)]
+            ns = w.step(s, a)
+            store.append(s, a, ns, i % 2 == 0, i)
+            rows.append((s, a, ns))
+            s = ns
+
+        self.assertEqual(len(store), 4)
+        self.assertEqual([ep["hash"] for ep in store], [2, 3, 4, 5])
+        self.assertEqual(store[-1]["state"], rows[-1][0])
+        self.assertEqual(store[0]["action"], rows[2][1])
+        self.assertEqual(store[0]["next_state"], rows[2][2])
+        with self.assertRaises(IndexError):
+            store[4]
+
+        # The newest 3 wrap around the end of the arrays: two zero-copy segments
+        window = store.last(3)
+        self.assertEqual(len(window.segments("x")), 2)
+        self.assertEqual(list(window.states()), [r[0] for r in rows[3:]])
+        self.assertEqual(list(window.next_states()), [r[2] for r in rows[3:]])
+        self.assertEqual([ACTIONS[i] for i in window.actions()], [r[1] for r in rows[3:]])
+
+        mem = Memory(episode_capacity=4)
+        for st, a, ns in rows:
+            mem.store_episode(st, a, ns, True)
+        self.assertEqual(len(mem.episodes), 4)
+        self.assertEqual(mem.get_similar_episodes(rows[4][0], k=1)[0]["state"], rows[4][0])
+
+    def test_similar_episodes_match_brute_force(self):
+        rng = random.Random(0)
+        w = PhysicsWorld()
+        mem = Memory(episode_capacity=200)
+        for _ in range(500):
+            s = State(
+                rng.uniform(-10, 10), rng.uniform(0, 20), rng.uniform(-3, 3),
+                rng.uniform(-3, 3), rng.uniform(0, 80), rng.randrange(3),
+            )
+            mem.store_episode(s, "wait", w.step(s, "wait"), True)
+
+        # Evicted episodes leave the index along with the ring buffer
+        self.assertEqual(len(mem.episode_index), 200)
+
+        scales = mem.episode_index.scales
+
+        def dist(a, b):
+            return sum(((u - v) / sc) ** 2 for u, v, sc in zip(a, b, scales)) ** 0.5
+
+        for _ in range(20):
+            q = State(rng.uniform(-10, 10), rng.uniform(0, 20), 0.0, 0.0, rng.uniform(0, 80), rng.randrange(3))
+            got = [ep["distance"] for ep in mem.get_similar_episodes(q, k=5)]
+            expected = sorted(dist(q, ep["state"]) for ep in mem.episodes)[:5]
+            for g, e in zip(got, expected):
+                self.assertAlmostEqual(g, e)
+            self.assertEqual(len(got), 5)
+
+    def test_episode_index_dense_grid_matches_brute_force(self):
+        # Many episodes in a small region: queries walk shells around their
+        # cell instead of ranking every occupied cell
+        rng = random.Random(1)
+        index = EpisodeIndex()
+        points = {}
+        for slot in range(8000):
+            s = State(rng.uniform(-8, 8), rng.uniform(0, 16), rng.uniform(-1, 1), 0.0, rng.uniform(20, 40), 0)
+            index.add(slot, s)
+            points[slot] = s
+
+        def dist(a, b):
+            return sum(((u - v) / sc) ** 2 for u, v, sc in zip(a, b, index.scales)) ** 0.5
+
+        for _ in range(20):
+            q = State(rng.uniform(-8, 8), rng.uniform(0, 16), 0.0, 0.0, rng.uniform(20, 40), 0)
+            got = [d for d, _ in index.query(q, k=5)]
+            expected = sorted(dist(q, p) for p in points.values())[:5]
+            for g, e in zip(got, expected):
+                self.assertAlmostEqual(g, e)
+            self.assertEqual(len(got), 5)
+
+    def test_memory_snapshot_roundtrip(self):
+        w = PhysicsWorld()
+        mem = Memory(episode_capacity=8)
+        mem.store_rule({"type": "gravity", "value": 0.3})
+        mem.store_rule({"type": "state_transition", "threshold": 50.0, "new_state": 1})
+        mem.store_skill(2, ["heat", "heat", "push_right"])
+        s = w.initial_state(1)
+        for i in range(11):
+            a = ACTIONS[i % len(ACTIONS)]
+            ns = w.step(s, a)
+            mem.store_episode(s, a, ns, i % 3 == 0)
+            s = ns
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "memory.snap")
+            mem.save(path)
+            with open(path, "rb") as f:
+                on_disk = f.read()
+
+            for use_mmap in (True, False):
+                loaded = Memory.load(path, mmap=use_mmap)
+                self.assertEqual([dict(r) for r in loaded.get_rules()], [dict(r) for r in mem.get_rules()])
+                self.assertEqual(loaded.get_skill(2), ["heat", "heat", "push_right"])
+                self.assertEqual(list(loaded.episodes), list(mem.episodes))
+                self.assertEqual(
+                    loaded.get_similar_episodes(s, k=3), mem.get_similar_episodes(s, k=3)
+                )
+
+                # New episodes go to the in-memory copy, never back to the file
+                loaded.store_episode(s, "wait", w.step(s, "wait"), True)
+                self.assertEqual(loaded.episodes[-1]["state"], s)
+                self.assertEqual(len(loaded.get_similar_episodes(s, k=20)), 8)
+
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), on_disk)
+
+            # A truncated file is rejected up front, not read short
+            with open(path, "r+b") as f:
+                f.truncate(len(on_disk) - 16)
+            for use_mmap in (True, False):
+                with self.assertRaises(ValueError):
+                    Memory.load(path, mmap=use_mmap)
+
+            with open(path, "r+b") as f:
+                f.write(b"garbage")
+            with self.assertRaises(ValueError):
+                Memory.load(path)
+
+    def test_batch_hypothesis_errors_match_single_tests(self):
+        w = PhysicsWorld()
+        agent = Agent()
+        s = w.initial_state(2)
+        for a in ("push_right", "heat", "heat", "wait", "cool", "push_left"):
+            ns = w.step(s, a)
+            agent.memory.store_episode(s, a, ns, True)
+            s = ns
+
+        lib = agent.causal_library
+        hypotheses = lib.generate_hypotheses(s, "wait", 1.0)
+        window = agent.memory.episodes.last(6)
+        errors = lib.evaluate_hypotheses(hypotheses, window)
+
+        self.assertEqual(len(errors), len(hypotheses))
+        for hyp, row in zip(hypotheses, errors):
+            self.assertEqual(len(row), 6)
+            for err, ep in zip(row, window):
+                self.assertAlmostEqual(err, lib.test_hypothesis(hyp, ep["state"], ep["action"], w))
+
+    def test_rule_fitter_recovers_hidden_rules(self):
+        rng = random.Random(1)
+        w = PhysicsWorld()
+        mem = Memory()
+        s = w.initial_state(2)
+        for _ in range(200):
+            a = rng.choice(ACTIONS)
+            ns = w.step(s, a)
+            mem.store_episode(s, a, ns, True)
+            s = ns if abs(ns["temp"]) < 100 else w.initial_state(2)
+
+        fits = {}
+        for hyp in Agent(memory=mem).causal_library.fitter.fit(mem.episodes.last(200)):
+            fits[(hyp["type"], hyp.get("new_state"))] = hyp
+
+        self.assertAlmostEqual(fits[("gravity", None)]["value"], 0.3, places=9)
+        self.assertAlmostEqual(fits[("friction", None)]["value"], 0.95, places=9)
+        # Only temps 15 apart are observed, so the threshold is bracketed, not exact
+        self.assertLess(abs(fits[("state_transition", 1)]["threshold"] - 50.0), 7.5)
+
+        hyps = Agent(memory=mem).causal_library.generate_hypotheses(s, "wait", 1.0)
+        keys = [tuple(sorted(mem._canonicalize_rule(h).items())) for h in hyps]
+        self.assertEqual(len(keys), len(set(keys)))
+        self.assertEqual(hyps[0].get("source"), "fit")
+
+    def test_hypothesis_stream_ranked_by_error_components(self):
+        lib = Agent().causal_library
+        s = State(0.0, 5.0, 0.0, 0.0, 55.0, 0)
+        predicted = s
+
+        stream = lib.iter_hypotheses(s, "heat", 2.0, predicted, s.replace(state=1))
+        self.assertEqual(next(stream)["type"], "state_transition")
+
+        stream = lib.iter_hypotheses(s, "wait", 2.0, predicted, s.replace(vx=0.5, vy=-0.3))
+        self.assertEqual(next(stream)["type"], "friction")
+
+        # A position-only miss (e.g. bounds clamping) is not a rule-type error
+        self.assertEqual(list(lib.iter_hypotheses(s, "wait", 2.0, predicted, s.replace(y=0.0))), [])
+
+        # Without error components every type is offered, each candidate once
+        hyps = list(lib.iter_hypotheses(s, "wait", 2.0))
+        self.assertEqual({h["type"] for h in hyps}, {"gravity", "friction", "state_transition"})
+        keys = [lib._hypothesis_key(h) for h in hyps]
+        self.assertEqual(len(keys), len(set(keys)))
+
+    def test_bench_compare_flags_regressions(self):
+        baseline = {"fast": {"best": 1.0}, "slow": {"best": 1.0}}
+        results = {"fast": {"best": 1.2}, "slow": {"best": 1.3}, "new": {"best": 5.0}}
+        rows = {r[0]: r for r in bench.compare(results, baseline, threshold=0.25)}
+        self.assertTrue(rows["fast"][4])
+        self.assertFalse(rows["slow"][4])
+        self.assertAlmostEqual(rows["slow"][3], 1.3)
+        self.assertEqual(rows["new"][1:], (None, 5.0, None, True))
+
+        results = bench.run_benchmarks("world.step", repeat=1)
+        self.assertIn("world.step", results)
+        self.assertGreater(results["world.step"]["best"], 0.0)
+
     def test_transfer_task2_possible(self):
         w = PhysicsWorld()
         agent = Agent()
@@ -51,6 +761,7 @@ class TestAGIDemo(unittest.TestCase):
         under the discretized BFS budget. This prevents 'optimize an impossible spec'.
         """
         w = PhysicsWorld()
+        w.reachability_cache = None  # certify by searching, even with $MARCOS_CACHE_DIR set
         reachable, path, expanded = w.reachability_check(
             1, max_steps=30, tol=0.50, max_expansions=250_000
         )
@@ -63,6 +774,7 @@ class TestAGIDemo(unittest.TestCase):
         At tol=0.55, reachability finds a 6-step witness quickly.
         """
         w = PhysicsWorld()
+        w.reachability_cache = None  # certify by searching, even with $MARCOS_CACHE_DIR set
         reachable, path, expanded = w.reachability_check(
             1, max_steps=30, tol=0.55, max_expansions=250_000
         )
@@ -76,6 +788,88 @@ class TestAGIDemo(unittest.TestCase):
             s = w.step(s.copy(), a)
         self.assertTrue(w.goal_achieved(s, 1, tol=0.55), f"Witness failed. Final state: {s}, path={path}")
 
+    def test_reachability_respects_horizon_and_budget(self):
+        w = PhysicsWorld()
+        w.reachability_cache = None  # certify by searching, even with $MARCOS_CACHE_DIR set
+        reachable, path, expanded = w.reachability_check(2, max_steps=30)
+        self.assertTrue(reachable)
+        self.assertEqual(path, ["heat", "heat", "push_right"])
+
+        # Shortest witness is 3 steps, so a 2-step horizon exhausts the space
+        reachable, path, expanded = w.reachability_check(2, max_steps=2)
+        self.assertEqual((reachable, path), (False, []))
+        self.assertLessEqual(expanded, 1 + 5 + 25)
+
+        reachable, path, expanded = w.reachability_check(1, max_expansions=100)
+        self.assertEqual((reachable, path, expanded), (False, [], 100))
+
+    def test_reachability_sweep_matches_individual_checks(self):
+        w = PhysicsWorld()
+        w.reachability_cache = None  # compare fresh searches
+        tols = [0.50, 0.55, None]
+        horizons = [2, 3, 6]
+        sweep = w.reachability_sweep([1, 2], tols, horizons, max_expansions=20_000)
+
+        self.assertEqual(len(sweep), 2 * len(tols) * len(horizons))
+        for (task_id, tol, max_steps), result in sweep.items():
+            expected = w.reachability_check(task_id, max_steps=max_steps, tol=tol, max_expansions=20_000)
+            self.assertEqual(result, expected, f"task={task_id} tol={tol} max_steps={max_steps}")
+
+    def test_reachability_cache_roundtrip_and_invalidation(self):
+        # Opt-in: no disk cache unless $MARCOS_CACHE_DIR is set
+        if not os.environ.get("MARCOS_CACHE_DIR"):
+            self.assertIsNone(PhysicsWorld().reachability_cache)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            w = PhysicsWorld()
+            w.reachability_cache = cache = ReachabilityCache(tmp)
+            fresh = PhysicsWorld()
+            fresh.reachability_cache = None
+            expected = fresh.reachability_check(1, max_steps=30, tol=0.55)
+
+            self.assertEqual(w.reachability_check(1, max_steps=30, tol=0.55), expected)
+            self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+            # Second audit: served from disk, no search
+            search = w._reachability_search
+            w._reachability_search = None
+            try:
+                self.assertEqual(w.reachability_check(1, max_steps=30, tol=0.55), expected)
+                sweep = w.reachability_sweep([1], [0.55], [30])
+            finally:
+                w._reachability_search = search
+            self.assertEqual(sweep[(1, 0.55, 30)], expected)
+            self.assertEqual(cache.hits, 2)
+
+            # Corrupt entries read as misses and are searched again
+            path = cache._path(cache.fingerprint(w, 1, 0.55, 30, 250_000))
+            for junk in ("null", "[1, 2]", "[true, 5, 3]", "{"):
+                with open(path, "w") as f:
+                    f.write(junk)
+                misses = cache.misses
+                self.assertEqual(w.reachability_check(1, max_steps=30, tol=0.55), expected)
+                self.assertEqual(cache.misses, misses + 1)
+
+            # Changing the world's rules or a task's tolerance changes the key
+            key = cache.fingerprint(w, 1, 0.55, 30, 250_000)
+            w.hidden_rules["gravity"] = 0.25
+            self.assertNotEqual(cache.fingerprint(w, 1, 0.55, 30, 250_000), key)
+            w.hidden_rules["gravity"] = 0.3
+            w.task_tol[1] = 0.6
+            self.assertNotEqual(cache.fingerprint(w, 1, None, 30, 250_000), cache.fingerprint(fresh, 1, None, 30, 250_000))
+
+            # So does physics outside hidden_rules, or a changed transition
+            class Hotter(PhysicsWorld):
+                def physics_spec(self):
+                    return dict(super().physics_spec(), cool_temp=25.0)
+
+            class Stiller(PhysicsWorld):
+                def _transition(self, x, y, vx, vy, temp, st, a):
+                    return super()._transition(x, y, 0.0, vy, temp, st, a)
+
+            keys = {cache.fingerprint(cls(), 1, 0.55, 30, 250_000) for cls in (PhysicsWorld, Hotter, Stiller)}
+            self.assertEqual(len(keys), 3)
+
 
 if __name__ == "__main__":
     unittest.main(verbosity=2)
@@ -0,0 +1,172 @@
+import multiprocessing
+import os
+import random
+
+from agent import Agent
+from memory import Memory
+from world import ACTIONS, PhysicsWorld
+
+
+def run_episode(agent, world, task_id, max_steps=30, tol=None, rng=None, explore=0.0):
+    """
+    One act/step/learn episode. With an rng, a random action replaces the
+    agent's choice with probability `explore`. Returns (success, steps).
+    """
+    state = world.initial_state(task_id)
+    goal = world.get_goal(task_id)
+
+    for step in range(max_steps):
+        action, _ = agent.act(state, goal, world)
+        if rng is not None and rng.random() < explore:
+            action = rng.choice(ACTIONS)
+        next_state = world.step(state, action)
+
+        agent.learn_from_experience(state, action, next_state, world)
+
+        if world.goal_achieved(next_state, task_id, tol=tol):
+            return True, step + 1
+        state = next_state
+
+    return False, max_steps
+
+
+class TrainingWorker:
+    """
+    One trainer lane: its own Agent and PhysicsWorld, a seeded rng and a task
+    mix. run() adopts the coordinator's merged rules and pooled skills, trains
+    for a number of episodes and reports what it knows.
+    """
+
+    def __init__(self, worker_id, seed, task_ids, max_steps=30, explore=0.1):
+        self.worker_id = worker_id
+        self.rng = random.Random(seed)
+        self.task_ids = list(task_ids)
+        self.max_steps = max_steps
+        self.explore = explore
+        self.world = PhysicsWorld()
+        self.agent = Agent(verbose=False)
+        self.successes = 0
+
+    def run(self, episodes, rules=(), skills=None):
+        for rule in rules:
+            self.agent.memory.store_rule(rule)
+        if skills is not None:
+            self.agent.memory.skills.from_records(skills)
+
+        agent, world, rng = self.agent, self.world, self.rng
+        for _ in range(episodes):
+            task_id = rng.choice(self.task_ids)
+            success, steps = run_episode(
+                agent, world, task_id, self.max_steps, rng=rng, explore=self.explore
+            )
+            if success:
+                self.successes += 1
+                # The episode is the newest `steps` stored transitions
+                window = agent.memory.episodes.last(steps)
+                agent.memory.store_skill(
+                    task_id,
+                    [ACTIONS[a] for a in window.actions()],
+                    list(window.states()),
+                    world.get_goal(task_id),
+                )
+            agent.episode_count += 1
+
+        # MappingProxyType rules don't pickle; ship plain dicts
+        return {
+            'worker_id': self.worker_id,
+            'rules': [dict(r) for r in agent.memory.get_rules()],
+            'skills': agent.memory.skills.to_records(),
+            'episodes': agent.episode_count,
+            'successes': self.successes,
+        }
+
+
+def _worker_loop(conn, worker_id, seed, task_ids, max_steps, explore):
+    worker = TrainingWorker(worker_id, seed, task_ids, max_steps, explore)
+    while True:
+        message = conn.recv()
+        if message is None:
+            conn.close()
+            return
+        conn.send(worker.run(*message))
+
+
+class Trainer:
+    """
+    Trains K independent agents and merges what they learn.
+
+    Worker i gets seed `seed + i` and task mix task_mix[i % len(task_mix)].
+    Training runs in rounds of `sync_every` episodes per worker; after each
+    round the coordinator merges every worker's rules into its own Memory
+    (store_rule's canonicalization drops duplicates, in worker order so the
+    merge is deterministic), pools their skill libraries, and sends the
+    merged rules and pooled skills back with the next round. With one worker
+    (or processes=1) everything runs in-process.
+    """
+
+    def __init__(self, num_workers=None, task_mix=((1,), (2,), (1, 2)), seed=0,
+                 sync_every=10, max_steps=30, explore=0.1, processes=None, memory=None):
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.task_mix = [tuple(m) for m in task_mix]
+        self.seed = seed
+        self.sync_every = sync_every
+        self.max_steps = max_steps
+        self.explore = explore
+        self.processes = self.num_workers if processes is None else processes
+        self.memory = Memory() if memory is None else memory
+        self.reports = []
+
+    def _worker_args(self, i):
+        return (i, self.seed + i, self.task_mix[i % len(self.task_mix)], self.max_steps, self.explore)
+
+    def train(self, episodes_per_worker=50):
+        """Run every worker for episodes_per_worker episodes; returns the merged Memory"""
+        rounds = []
+        left = episodes_per_worker
+        while left > 0:
+            rounds.append(min(self.sync_every, left))
+            left -= rounds[-1]
+
+        if self.processes <= 1 or self.num_workers <= 1:
+            workers = [TrainingWorker(*self._worker_args(i)) for i in range(self.num_workers)]
+            for episodes in rounds:
+                rules, skills = self._merged_rules(), self.memory.skills.to_records()
+                self._merge([w.run(episodes, rules, skills) for w in workers])
+            return self.memory
+
+        ctx = multiprocessing.get_context()
+        conns, procs = [], []
+        try:
+            for i in range(self.num_workers):
+                parent, child = ctx.Pipe()
+                proc = ctx.Process(target=_worker_loop, args=(child, *self._worker_args(i)), daemon=True)
+                proc.start()
+                child.close()
+                conns.append(parent)
+                procs.append(proc)
+
+            for episodes in rounds:
+                message = (episodes, self._merged_rules(), self.memory.skills.to_records())
+                for conn in conns:
+                    conn.send(message)
+                self._merge([conn.recv() for conn in conns])
+        finally:
+            for conn in conns:
+                try:
+                    conn.send(None)
+                except (BrokenPipeError, OSError):
+                    pass
+                conn.close()
+            for proc in procs:
+                proc.join()
+        return self.memory
+
+    def _merged_rules(self):
+        return [dict(r) for r in self.memory.get_rules()]
+
+    def _merge(self, reports):
+        for report in sorted(reports, key=lambda r: r['worker_id']):
+            for rule in report['rules']:
+                self.memory.store_rule(rule)
+            self.memory.skills.from_records(report['skills'])
+        self.reports = reports
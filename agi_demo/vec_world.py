@@ -0,0 +1,121 @@
+from array import array
+
+from state import FIELDS, FIELD_INDEX, State
+from world import PhysicsWorld
+
+
+class VecPhysicsWorld:
+    """
+    N independent PhysicsWorld episodes stepped together.
+
+    Lane states are kept struct-of-arrays (one column per state field), so a
+    step is a single PhysicsWorld.step_batch call. Tasks are assigned to lanes
+    round-robin from `task_ids` (default: every task in get_tasks). A lane's
+    episode ends when it reaches its goal (at the task's spec `_tol`) or after
+    `max_steps` steps, and the lane is then reset to its task's initial state.
+    """
+
+    def __init__(self, num_envs, task_ids=None, world=None, max_steps=30):
+        if num_envs <= 0:
+            raise ValueError("num_envs must be positive")
+        self.world = PhysicsWorld() if world is None else world
+        self.num_envs = num_envs
+        self.max_steps = max_steps
+
+        tasks = self.world.get_tasks()
+        task_ids = sorted(tasks) if task_ids is None else list(task_ids)
+        for task_id in task_ids:
+            if task_id not in tasks:
+                raise ValueError(f"Unknown task: {task_id}")
+
+        self.task_ids = array("l", (task_ids[i % len(task_ids)] for i in range(num_envs)))
+        self._initial = {t: self.world.initial_state(t) for t in task_ids}
+        self._goals = {t: _goal_targets(self.world.get_goal(t)) for t in task_ids}
+
+        self.columns = {k: _zeros("b" if k == "state" else "d", num_envs) for k in FIELDS}
+        self.steps = _zeros("l", num_envs)
+        self.episodes_finished = 0
+        self.episodes_succeeded = 0
+        self.reset()
+
+    def __len__(self):
+        return self.num_envs
+
+    def reset(self):
+        """Restart every lane's episode; returns the state columns"""
+        for i in range(self.num_envs):
+            self._reset_lane(i)
+        return self.columns
+
+    def state(self, i):
+        cols = self.columns
+        return State(*(cols[k][i] for k in FIELDS))
+
+    def states(self):
+        return list(map(State, *(self.columns[k] for k in FIELDS)))
+
+    def goal(self, i):
+        return self.world.get_goal(self.task_ids[i])
+
+    def step(self, actions):
+        """
+        Step every lane by one action (a column of indices into ACTIONS).
+
+        Returns (next_columns, achieved, done): the post-step state columns
+        before any reset (so each lane's transition is complete), and per-lane
+        array('b') flags for goal reached and episode over. Finished lanes are
+        reset in self.columns, ready for the next step.
+        """
+        if len(actions) != self.num_envs:
+            raise ValueError("need one action per lane")
+        next_columns = self.world.step_batch(self.columns, actions)
+
+        n = self.num_envs
+        achieved = _zeros("b", n)
+        done = _zeros("b", n)
+        steps = self.steps
+        goals = self._goals
+        rows = [next_columns[k] for k in FIELDS]
+
+        for i in range(n):
+            targets, tol = goals[self.task_ids[i]]
+            hit = True
+            for col, target, exact in targets:
+                v = rows[col][i]
+                if (v != target) if exact else (abs(v - target) > tol):
+                    hit = False
+                    break
+            steps[i] += 1
+            if hit:
+                achieved[i] = 1
+            if hit or steps[i] >= self.max_steps:
+                done[i] = 1
+
+        # Carry the batch forward, then restart the finished lanes
+        for k in FIELDS:
+            self.columns[k][:] = next_columns[k]
+        for i in range(n):
+            if done[i]:
+                self.episodes_finished += 1
+                self.episodes_succeeded += achieved[i]
+                self._reset_lane(i)
+
+        return next_columns, achieved, done
+
+    def _reset_lane(self, i):
+        cols = self.columns
+        for k, v in zip(FIELDS, self._initial[self.task_ids[i]]):
+            cols[k][i] = v
+        self.steps[i] = 0
+
+
+def _zeros(code, n):
+    return array(code, bytes(array(code).itemsize * n))
+
+
+def _goal_targets(goal):
+    # ([(field index, target, exact match?)], tol), matching goal_achieved
+    targets = [
+        (FIELD_INDEX[k], t, k == "state") for k, t in goal.items() if k not in ("task_id", "_tol")
+    ]
+    return targets, goal.get("_tol", 0.50)
@@ -1,6 +1,36 @@
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from reachability_cache import ReachabilityCache
+from state import FIELD_INDEX, State
+from state_hash import REACHABILITY
+
+ACTIONS = ("push_right", "push_left", "heat", "cool", "wait")
+ACTION_INDEX = {a: i for i, a in enumerate(ACTIONS)}
+
+# Per-action (dvx, dtemp), indexed like ACTIONS
+ACTION_EFFECTS = (
+    (1.0, 0.0),
+    (-1.0, 0.0),
+    (0.0, 15.0),
+    (0.0, -15.0),
+    (0.0, 0.0),
+)
+
+# Physics outside hidden_rules, shared by _transition and step_batch: below
+# COOL_TEMP state 2 relaxes back to 0, and positions are clamped to the box
+COOL_TEMP = 20.0
+X_MIN, X_MAX = -10.0, 10.0
+Y_MIN, Y_MAX = 0.0, 20.0
+
+
 class PhysicsWorld:
     """Deterministic toy world with hidden rules"""
 
+    # Set through Instrumentation.instrument_world to count steps
+    instrumentation = None
+
     def __init__(self):
         self.hidden_rules = {
             "gravity": 0.3,
@@ -9,53 +39,156 @@ class PhysicsWorld:
         }
         # Default per-task tolerance used by the *spec* (planner should respect this)
         self.task_tol = {1: 0.55, 2: 0.50}
+        # Persistent reachability results, opt-in: on when $MARCOS_CACHE_DIR is
+        # set, or assign a ReachabilityCache; None searches every time
+        self.reachability_cache = ReachabilityCache() if os.environ.get("MARCOS_CACHE_DIR") else None
 
     def step(self, state, action):
+        """
+        Advance one state by one action. Accepts a State (returns a State) or a
+        legacy dict state (returns a new dict, other keys preserved).
+        """
+        i = ACTION_INDEX.get(action)
+        if i is None:
+            raise ValueError(f"Unknown action: {action}")
+        if self.instrumentation is not None:
+            self.instrumentation.count("world.step")
+
+        if isinstance(state, State):
+            return tuple.__new__(State, self._transition(*state, i))
+
         s = state.copy()
+        (s["x"], s["y"], s["vx"], s["vy"], s["temp"], s["state"]) = self._transition(
+            s["x"], s["y"], s["vx"], s["vy"], s["temp"], s["state"], i
+        )
+        return s
 
-        # Apply action
-        if action == "push_right":
-            s["vx"] += 1.0
-        elif action == "push_left":
-            s["vx"] -= 1.0
-        elif action == "heat":
-            s["temp"] += 15.0
-        elif action == "cool":
-            s["temp"] -= 15.0
-        elif action == "wait":
-            pass
-        else:
-            raise ValueError(f"Unknown action: {action}")
+    def _transition(self, x, y, vx, vy, temp, st, a):
+        dvx, dtemp = ACTION_EFFECTS[a]
+        rules = self.hidden_rules
+        f = rules["friction"]
 
-        # Hidden physics
-        s["vy"] -= self.hidden_rules["gravity"]
-        s["vx"] *= self.hidden_rules["friction"]
-        s["vy"] *= self.hidden_rules["friction"]
+        # Apply action + hidden physics
+        vx = (vx + dvx) * f
+        vy = (vy - rules["gravity"]) * f
+        temp = temp + dtemp
 
-        s["x"] += s["vx"]
-        s["y"] += s["vy"]
+        x = x + vx
+        y = y + vy
 
         # Hidden state transitions
-        if s["temp"] > self.hidden_rules["temp_threshold"]:
-            if s["state"] == 0:
-                s["state"] = 1
-            elif s["state"] == 1:
-                s["state"] = 2
-        elif s["temp"] < 20.0:
-            if s["state"] == 2:
-                s["state"] = 0
+        if temp > rules["temp_threshold"]:
+            if st == 0:
+                st = 1
+            elif st == 1:
+                st = 2
+        elif temp < COOL_TEMP:
+            if st == 2:
+                st = 0
 
         # Bounds
-        if s["x"] < -10:
-            s["x"] = -10
-        if s["x"] > 10:
-            s["x"] = 10
-        if s["y"] < 0:
-            s["y"] = 0
-        if s["y"] > 20:
-            s["y"] = 20
+        if x < X_MIN:
+            x = X_MIN
+        if x > X_MAX:
+            x = X_MAX
+        if y < Y_MIN:
+            y = Y_MIN
+        if y > Y_MAX:
+            y = Y_MAX
 
-        return s
+        return x, y, vx, vy, temp, st
+
+    def step_batch(self, states, actions):
+        """
+        Step many independent states at once.
+
+        `states` is struct-of-arrays: a mapping with equal-length "x", "y", "vx",
+        "vy", "temp" and "state" columns; any sequence works, and "state" may
+        hold integral floats (NumPy's default dtype). `actions` is a column of
+        indices into ACTIONS. Returns new columns (array('d') floats, array('b') for "state")
+        whose values match calling `step` on each row (the loop body is
+        `_transition` inlined, reading the same module constants).
+        """
+        xs, ys = states["x"], states["y"]
+        vxs, vys = states["vx"], states["vy"]
+        temps, sts = states["temp"], states["state"]
+
+        n = len(actions)
+        for col in (xs, ys, vxs, vys, temps, sts):
+            if len(col) != n:
+                raise ValueError("state columns and actions must have equal length")
+        if self.instrumentation is not None:
+            self.instrumentation.count("world.step", n)
+
+        g = self.hidden_rules["gravity"]
+        f = self.hidden_rules["friction"]
+        thr = self.hidden_rules["temp_threshold"]
+        effects = ACTION_EFFECTS
+        cool = COOL_TEMP
+        x_min, x_max, y_min, y_max = X_MIN, X_MAX, Y_MIN, Y_MAX
+
+        out_x, out_y = array("d"), array("d")
+        out_vx, out_vy = array("d"), array("d")
+        out_temp, out_state = array("d"), array("b")
+
+        for x, y, vx, vy, temp, st, a in zip(xs, ys, vxs, vys, temps, sts, actions):
+            if not 0 <= a < 5:
+                raise ValueError(f"Unknown action index: {a}")
+            dvx, dtemp = effects[a]
+            vx = (vx + dvx) * f
+            vy = (vy - g) * f
+            temp = temp + dtemp
+            x = x + vx
+            y = y + vy
+
+            if temp > thr:
+                if st == 0:
+                    st = 1
+                elif st == 1:
+                    st = 2
+            elif temp < cool:
+                if st == 2:
+                    st = 0
+
+            if x < x_min:
+                x = x_min
+            if x > x_max:
+                x = x_max
+            if y < y_min:
+                y = y_min
+            if y > y_max:
+                y = y_max
+
+            out_x.append(x)
+            out_y.append(y)
+            out_vx.append(vx)
+            out_vy.append(vy)
+            out_temp.append(temp)
+            out_state.append(int(st))
+
+        return {
+            "x": out_x,
+            "y": out_y,
+            "vx": out_vx,
+            "vy": out_vy,
+            "temp": out_temp,
+            "state": out_state,
+        }
+
+    def physics_spec(self):
+        """The fixed physics outside hidden_rules: action effects, cool-down and bounds"""
+        return {
+            'action_effects': dict(zip(ACTIONS, ACTION_EFFECTS)),
+            'cool_temp': COOL_TEMP,
+            'x_bounds': (X_MIN, X_MAX),
+            'y_bounds': (Y_MIN, Y_MAX),
+        }
+
+    def __getstate__(self):
+        # Instrumentation holds a lock and a file; sweep workers don't need it
+        state = self.__dict__.copy()
+        state.pop("instrumentation", None)
+        return state
 
     def get_tasks(self):
         return {
@@ -72,6 +205,9 @@ class PhysicsWorld:
     def reset(self, task_id):
         return self.get_tasks()[task_id]["initial_state"].copy()
 
+    def initial_state(self, task_id):
+        return State.from_dict(self.get_tasks()[task_id]["initial_state"])
+
     def get_goal(self, task_id):
         # IMPORTANT: embed the spec tolerance into the goal so planners can’t “solve the wrong problem”.
         g = self.get_tasks()[task_id]["goal_state"].copy()
@@ -95,58 +231,168 @@ class PhysicsWorld:
         return True
 
     def reachability_check(self, task_id, max_steps=30, tol=None, max_expansions=250_000):
-        # Note: this is your existing validator interface; keep behavior consistent.
-        from collections import deque
+        """
+        Breadth-first spec validator. Returns (reachable, witness_path, expanded).
+
+        Nodes live in a flat arena of typed arrays (state columns, parent index,
+        action index); BFS order is arena order, so the queue is just a read
+        cursor and depth is tracked per BFS level. Visited states are packed
+        integer keys (state_hash.REACHABILITY) and the witness is rebuilt from
+        parent pointers only once a goal is hit. With a reachability_cache
+        set, results are cached on disk, so repeating an audit costs a file
+        read.
+        """
+        sweep = self.reachability_sweep([task_id], [tol], [max_steps], max_expansions)
+        return sweep[(task_id, tol, max_steps)]
+
+    def reachability_sweep(self, task_ids, tols, max_steps_list, max_expansions=250_000, processes=None):
+        """
+        Audit every (task_id, tol, max_steps) combination.
+
+        Returns {(task_id, tol, max_steps): (reachable, witness_path, expanded)},
+        each entry identical to the corresponding reachability_check call. The
+        visit order of the BFS doesn't depend on tol, and a shorter horizon only
+        sees a prefix of a longer one, so each task is searched once for all
+        its combinations. Tasks are spread over a process pool; tasks whose
+        combinations are all in the reachability cache aren't searched.
+        """
+        tols = list(tols)
+        horizons = list(max_steps_list)
+        combos = [(task_id, tol, h) for task_id in task_ids for tol in tols for h in horizons]
+
+        cache = self.reachability_cache
+        keys = {}
+        cached = {}
+        if cache is not None:
+            for combo in combos:
+                keys[combo] = key = cache.fingerprint(self, *combo, max_expansions)
+                result = cache.get(key)
+                if result is not None:
+                    cached[combo] = result
+
+        search_ids = list(dict.fromkeys(c[0] for c in combos if c not in cached))
+        jobs = [(self, task_id, tols, horizons, max_expansions) for task_id in search_ids]
+
+        if processes is None:
+            processes = min(len(jobs), os.cpu_count() or 1)
+
+        if processes <= 1 or len(jobs) <= 1:
+            outputs = map(_sweep_job, jobs)
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                outputs = list(pool.map(_sweep_job, jobs))
+
+        searched = {}
+        for task_id, results in zip(search_ids, outputs):
+            for (tol, max_steps), result in results.items():
+                combo = (task_id, tol, max_steps)
+                searched[combo] = result
+                if cache is not None and combo not in cached:
+                    cache.put(keys[combo], result)
 
-        initial = self.reset(task_id)
+        return {combo: cached[combo] if combo in cached else searched[combo] for combo in combos}
+
+    def _reachability_search(self, task_id, tols, horizons, max_expansions):
+        # One BFS answering several (tol, horizon) queries; see reachability_check.
+        initial = self.initial_state(task_id)
         goal = self.get_goal(task_id)
-        use_tol = goal.get("_tol", 0.50) if tol is None else tol
+        default_tol = goal.get("_tol", 0.50)
+
+        targets = [
+            (FIELD_INDEX[k], t) for k, t in goal.items() if k not in ("task_id", "_tol")
+        ]
+
+        # Unresolved queries: (tol used for matching, horizon, result key)
+        pending = [
+            (default_tol if tol is None else tol, h, (tol, h))
+            for tol in tols
+            for h in horizons
+        ]
+        results = {}
+        max_depth = max(horizons)
+
+        # Node arena
+        xs, ys, vxs, vys, temps = (array("d") for _ in range(5))
+        sts = array("b")
+        parents = array("l")
+        acts = array("b")
+
+        def push(st, parent, a):
+            xs.append(st[0])
+            ys.append(st[1])
+            vxs.append(st[2])
+            vys.append(st[3])
+            temps.append(st[4])
+            sts.append(st[5])
+            parents.append(parent)
+            acts.append(a)
+
+        push(initial, -1, -1)
+        discretize = REACHABILITY.key
+        visited = {discretize(*initial)}
+        transition = self._transition
+        inf = float("inf")
 
-        actions = ["push_right", "push_left", "heat", "cool", "wait"]
-
-        def discretize(st):
-            # coarse hash to prevent infinite explosion
-            return (
-                round(st["x"] * 2) / 2,
-                round(st["y"] * 2) / 2,
-                round(st["vx"] * 2) / 2,
-                round(st["vy"] * 2) / 2,
-                round(st["temp"] / 5) * 5,
-                st["state"],
-            )
-
-        def matches(st):
-            for k, t in goal.items():
-                if k in ("task_id", "_tol"):
-                    continue
-                if k == "state":
-                    if st["state"] != t:
-                        return False
+        head = 0
+        depth = 0
+        level_end = 1
+
+        while pending and head < len(parents) and head < max_expansions:
+            if head == level_end:
+                depth += 1
+                level_end = len(parents)
+                # Every node within a shorter horizon has been visited
+                for q in [q for q in pending if q[1] < depth]:
+                    results[q[2]] = (False, [], head)
+                    pending.remove(q)
+                if not pending:
+                    break
+
+            st = (xs[head], ys[head], vxs[head], vys[head], temps[head], sts[head])
+
+            # Largest per-key deviation from the goal; inf if the discrete state differs
+            dev = 0.0
+            for i, t in targets:
+                if i == 5:
+                    if st[5] != t:
+                        dev = inf
+                        break
                 else:
-                    if abs(st[k] - t) > use_tol:
-                        return False
-            return True
+                    d = abs(st[i] - t)
+                    if d > dev:
+                        dev = d
 
-        q = deque()
-        q.append((initial.copy(), []))
-        visited = {discretize(initial)}
-        expanded = 0
+            hits = [q for q in pending if dev <= q[0]]
+            if hits:
+                path = _rebuild_path(parents, acts, head)
+                for q in hits:
+                    results[q[2]] = (True, path, head + 1)
+                    pending.remove(q)
 
-        while q and expanded < max_expansions:
-            st, path = q.popleft()
-            expanded += 1
+            if depth < max_depth:
+                for a in range(5):
+                    ns = transition(*st, a)
+                    key = discretize(*ns)
+                    if key not in visited:
+                        visited.add(key)
+                        push(ns, head, a)
 
-            if matches(st):
-                return True, path, expanded
+            head += 1
 
-            if len(path) >= max_steps:
-                continue
+        for q in pending:
+            results[q[2]] = (False, [], head)
+        return results
+
+
+def _sweep_job(job):
+    world, task_id, tols, horizons, max_expansions = job
+    return world._reachability_search(task_id, tols, horizons, max_expansions)
 
-            for a in actions:
-                ns = self.step(st.copy(), a)
-                d = discretize(ns)
-                if d not in visited:
-                    visited.add(d)
-                    q.append((ns, path + [a]))
 
-        return False, [], expanded
+def _rebuild_path(parents, acts, node):
+    path = []
+    while parents[node] >= 0:
+        path.append(ACTIONS[acts[node]])
+        node = parents[node]
+    path.reverse()
+    return path
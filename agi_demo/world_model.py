@@ -1,70 +1,172 @@
+from array import array
+from collections import OrderedDict, deque
+
+from state import State
+from state_hash import StateHasher
+from world import ACTION_EFFECTS, ACTION_INDEX
+
 class WorldModel:
     """Predictive model of world dynamics"""
 
-    def __init__(self, memory):
+    def __init__(self, memory, cache_size=4096, cache_resolution=0.1):
         self.memory = memory
-        self.prediction_cache = {}
-        self.recent_errors = []
-        self.learned_dynamics = {}
 
-    def predict(self, state, action):
+        # LRU of (quantized state, action, rule version) -> predicted State.
+        # Entries for older rule versions are never hit again and age out.
+        self.prediction_cache = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_resolution = cache_resolution
+        self._cache_hasher = StateHasher((cache_resolution,) * 5 + (1.0,))
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+        # Every prediction made, cached or not (predict, predict_batch rows,
+        # prediction_errors rows)
+        self.predictions = 0
+
+        # Running window of prediction errors; the sum and the derived
+        # confidence are kept up to date on every update.
+        self.recent_errors = deque(maxlen=50)
+        self._error_sum = 0.0
+        self._updates = 0
+        self._confidence = 0.1
+
+        # (rule version, dynamics compiled from it), replaced as one tuple so
+        # threads never pair one version with another version's dynamics;
+        # see _compile_rules
+        self._compiled = (None, self._compile_rules(()))
+
+    def predict(self, state, action, use_cache=True):
         """Predict next state given action"""
-        cache_key = (
-            f"{state['x']:.1f},{state['y']:.1f},{state['vx']:.1f},{state['vy']:.1f},"
-            f"{state['temp']:.1f},{state['state']},{action}"
-        )
+        state = State.coerce(state)
+        self.predictions += 1
+        version, dynamics = self._dynamics()
+        if not use_cache:
+            return self._apply_model(state, ACTION_INDEX.get(action), dynamics), self._confidence
 
-        if cache_key in self.prediction_cache:
-            pred, conf = self.prediction_cache[cache_key]
-            return pred.copy(), conf
+        # Keyed by the version the dynamics were compiled from, never a newer one
+        key = self._cache_key(state, action, version)
 
-        pred = state.copy()
+        pred = self._cache_get(key)
+        if pred is None:
+            pred = self._apply_model(state, ACTION_INDEX.get(action), dynamics)
+            self._cache_put(key, pred)
 
-        # Apply known action effects
-        if action == 'push_right':
-            pred['vx'] += 1.0
-        elif action == 'push_left':
-            pred['vx'] -= 1.0
-        elif action == 'heat':
-            pred['temp'] += 15.0
-        elif action == 'cool':
-            pred['temp'] -= 15.0
-        elif action == 'wait':
-            pass
-
-        # Apply learned rules
-        for rule in self.memory.get_rules():
-            pred = self._apply_rule(pred, rule)
+        return pred, self._confidence
 
-        # Update position
-        pred['x'] += pred['vx']
-        pred['y'] += pred['vy']
+    def predict_batch(self, states, actions):
+        """
+        Predict many (state, action) pairs in one call. Returns (list of States,
+        array('d') of confidences), rows matching predict() calls.
 
-        confidence = self._calculate_confidence()
+        The cache lookup and the compiled transition are fused into one loop:
+        the dynamics (with the rule version they were compiled from) and the
+        cache key function are read once per batch rather than once per row.
+        """
+        if len(states) != len(actions):
+            raise ValueError("states and actions must have equal length")
+        self.predictions += len(states)
 
-        self.prediction_cache[cache_key] = (pred.copy(), confidence)
-        return pred, confidence
+        version, dynamics = self._dynamics()
+        vx_scale = dynamics['vx_scale']
+        vy_scale = dynamics['vy_scale']
+        vy_offset = dynamics['vy_offset']
+        transitions = dynamics['transitions']
+        index = ACTION_INDEX.get
+        effects = ACTION_EFFECTS
+        hasher_key = self._cache_hasher.key
+        cache = self.prediction_cache
+        cache_size = self.cache_size
+        hits = misses = evictions = 0
+
+        preds = []
+        for state, action in zip(states, actions):
+            key = (hasher_key(*state), action, version)
+            pred = cache.get(key)
+            if pred is not None:
+                cache.move_to_end(key)
+                hits += 1
+                preds.append(pred)
+                continue
+            misses += 1
+
+            # _apply_model, inlined
+            x, y, vx, vy, temp, st = state
+            a = index(action)
+            if a is not None:
+                dvx, dtemp = effects[a]
+                vx += dvx
+                temp += dtemp
+            vx *= vx_scale
+            vy = vy * vy_scale + vy_offset
+            for threshold, new_state in transitions:
+                if temp > threshold:
+                    st = new_state
+                    break
+            pred = State(x + vx, y + vy, vx, vy, temp, st)
+
+            cache[key] = pred
+            if len(cache) > cache_size:
+                cache.popitem(last=False)
+                evictions += 1
+            preds.append(pred)
+
+        self.cache_hits += hits
+        self.cache_misses += misses
+        self.cache_evictions += evictions
+        confidences = array('d', [self._confidence]) * len(preds)
+        return preds, confidences
+
+    def cache_stats(self):
+        return {
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'evictions': self.cache_evictions,
+            'size': len(self.prediction_cache),
+            'capacity': self.cache_size,
+        }
 
     def update_from_experience(self, state, action, next_state):
         """Learn from discrepancy"""
         pred, _ = self.predict(state, action)
 
-        # Clear cache since model might be updated soon
-        self.prediction_cache = {}
-
         error = self._calculate_error(pred, next_state)
 
-        self.recent_errors.append(error)
-        if len(self.recent_errors) > 50:
-            self.recent_errors = self.recent_errors[-50:]
+        errors = self.recent_errors
+        if len(errors) == errors.maxlen:
+            self._error_sum -= errors[0]
+        errors.append(error)
+        self._error_sum += error
+        self._updates += 1
+        if self._updates % errors.maxlen == 0:
+            # Once per full window, drop accumulated rounding drift
+            self._error_sum = sum(errors)
+        self._confidence = self._calculate_confidence()
 
         return error
 
+    def prediction_errors(self, window):
+        """Current model's (uncached) error on each transition of an EpisodeWindow"""
+        _, dynamics = self._dynamics()
+        apply_model = self._apply_model
+        calculate_error = self._calculate_error
+        errors = array('d', (
+            calculate_error(apply_model(s, a, dynamics), ns)
+            for s, a, ns in zip(window.states(), window.actions(), window.next_states())
+        ))
+        self.predictions += len(errors)
+        return errors
+
+    @property
+    def confidence(self):
+        """Current confidence, as predict() reports it"""
+        return self._confidence
+
     def get_prediction_error(self):
         """Average error of recent predictions"""
         if not self.recent_errors:
             return 1.0
-        return sum(self.recent_errors) / len(self.recent_errors)
+        return self._error_sum / len(self.recent_errors)
 
     def _calculate_confidence(self):
         """Real confidence based on recent prediction errors"""
@@ -77,21 +179,90 @@ class WorldModel:
         conf = max(0.05, min(0.95, conf))
         return conf
 
-    def _apply_rule(self, state, rule):
-        """Apply a causal rule to state"""
-        s = state.copy()
-
-        t = rule.get('type')
-        if t == 'gravity':
-            s['vy'] -= rule['value']
-        elif t == 'friction':
-            s['vx'] *= rule['value']
-            s['vy'] *= rule['value']
-        elif t == 'state_transition':
-            if s['temp'] > rule['threshold']:
-                s['state'] = rule['new_state']
-
-        return s
+    @property
+    def learned_dynamics(self):
+        """Dynamics compiled from the rule set, as of the last prediction"""
+        return self._compiled[1]
+
+    def _dynamics(self):
+        # Returns (version, dynamics). Both come from one rule snapshot and are
+        # published as one tuple, so a racing compile on another thread can
+        # only replace the pair, never mix its halves.
+        compiled = self._compiled
+        version, rules = self.memory.rule_snapshot()
+        if compiled[0] != version:
+            compiled = (version, self._compile_rules(rules))
+            self._compiled = compiled
+        return compiled
+
+    def _compile_rules(self, rules):
+        """
+        Fuse the ordered rule list into one transition:
+            vx' = vx_scale * vx
+            vy' = vy_scale * vy + vy_offset
+            state' = new_state of the last transition rule whose threshold < temp
+        """
+        vx_scale, vy_scale, vy_offset = 1.0, 1.0, 0.0
+        transitions = []
+
+        for rule in rules:
+            t = rule.get('type')
+            if t == 'gravity':
+                vy_offset -= rule['value']
+            elif t == 'friction':
+                vx_scale *= rule['value']
+                vy_scale *= rule['value']
+                vy_offset *= rule['value']
+            elif t == 'state_transition':
+                transitions.append((rule['threshold'], rule['new_state']))
+
+        transitions.reverse()  # later rules win, so test them first
+        return {
+            'vx_scale': vx_scale,
+            'vy_scale': vy_scale,
+            'vy_offset': vy_offset,
+            'transitions': tuple(transitions),
+        }
+
+    def _cache_key(self, state, action, version):
+        return self._cache_hasher.key(*state), action, version
+
+    def _cache_get(self, key):
+        cache = self.prediction_cache
+        pred = cache.get(key)
+        if pred is None:
+            self.cache_misses += 1
+            return None
+        cache.move_to_end(key)
+        self.cache_hits += 1
+        return pred
+
+    def _cache_put(self, key, pred):
+        cache = self.prediction_cache
+        cache[key] = pred
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+            self.cache_evictions += 1
+
+    def _apply_model(self, state, action_index, dynamics):
+        x, y, vx, vy, temp, st = state
+
+        # Apply known action effects
+        if action_index is not None:
+            dvx, dtemp = ACTION_EFFECTS[action_index]
+            vx += dvx
+            temp += dtemp
+
+        # Apply learned dynamics
+        vx *= dynamics['vx_scale']
+        vy = vy * dynamics['vy_scale'] + dynamics['vy_offset']
+        for threshold, new_state in dynamics['transitions']:
+            if temp > threshold:
+                st = new_state
+                break
+
+        # Update position
+        return State(x + vx, y + vy, vx, vy, temp, st)
 
     def _calculate_error(self, pred, actual):
         """Calculate total prediction error"""